@@ -6,17 +6,26 @@ import argparse
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.optimize import curve_fit
-from astropy.timeseries import LombScargle
 
-from utt.model import db, StationPair, StationDistanceReading as SDR
+from utt.model import db, StationPair
 from utt import app
-from utt.gct import as_gct
+from utt.fit import (
+    apply_fit,
+    fit_pair,
+    fit_pairs,
+    initial_parameters,
+    is_small_difference,
+    last_reading_ids,
+    load_readings,
+    squared_distance,
+)
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Automatic fitting of station pair data')
     parser.add_argument('--improve', action='store_true')
     parser.add_argument('--all', action='store_true')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Number of worker processes for --all (default: one per CPU)')
     parser.add_argument('station_id', type=int, nargs='?')
 
     return parser.parse_args()
@@ -28,25 +37,24 @@ else:
     assert options.station_id, 'Need --all or station_id'
 
 
+def print_result(pair, result):
+    if result['converged']:
+        print('Curve fit results: period = {:.2f} u, radius = [{:.2f} {:.2f}] km'.format(
+            result['period'],
+            result['min_distance'],
+            result['max_distance']))
+    else:
+        print('Fit did not converge: {}'.format(result['message']))
 
-def improve_one(pair, interactive=True):
-    readings = SDR.query.filter_by(station_pair_id=pair.id).order_by(SDR.when)
-
-    x = []
-    y = []
-    for reading in readings:
-        x.append(float(as_gct(reading.when, format=False)))
-        y.append(float(reading.distance_km * reading.distance_km))
 
-    min_y = min(y)
-    max_y = max(y)
-    baseline = (min_y + max_y) / 2
-    amplitude = (max_y - min_y) / 2
-    if pair.fit_min_distance_km is not None and pair.fit_max_distance_km is not None:
-        baseline, amplitude = pair.baseline_amptlitude_pair
+def improve_one(pair):
+    last_reading_id = last_reading_ids([pair.id]).get(pair.id)
+    readings = load_readings([pair.id]).get(pair.id)
+    assert readings is not None, 'No readings for {}'.format(pair)
+    x, y = readings
+    period, amplitude, baseline, phase = initial_parameters(pair, y)
 
-    if pair.fit_period_u:
-        period = pair.fit_period_u
+    if period:
         fudge_factor = 2
     else:
         plt.gcf().set_size_inches(12, 9)
@@ -56,94 +64,78 @@ def improve_one(pair, interactive=True):
         count_periods = float(input('Rough number of periods in the plot: '))
         period = (max(x) - min(x))/ count_periods
         fudge_factor = 10
-    phase = pair.fit_phase or 0.0
-
-    est_freq = 1 / period
-    freqs = np.linspace(est_freq / fudge_factor, est_freq * fudge_factor, 1600)
-    
-    power = LombScargle(x, y).power(freqs)
-    period = 1/freqs[np.argmax(power)]
-    print('Period determined by LS: ', period)
-
-    # prepare for least-squares curve fit
-    def f(x, period, amplitude, baseline, phase):
-        if amplitude > baseline:
-            return 1e20
-        return np.cos(np.array(x) * (2 * np.pi / period) + phase) * amplitude + baseline
-
-    initial = [period, amplitude, baseline, phase]
-    lower = [0.5 *  period, 0.8 * amplitude, 0.5 * baseline, - 21 * np.pi]
-    upper = [2.0 * period,  10 * amplitude, 10 * baseline, 21 * np.pi ]
-    fit_result, prec = curve_fit(f, x, y, initial, bounds=[lower, upper])
-    print(fit_result)
-    min_distance = math.sqrt(fit_result[2] - fit_result[1])
-    max_distance = math.sqrt(fit_result[2] + fit_result[1])
-    print(prec)
-    print('Curve fit results: period = {:.2f} u, radius = [{:.2f} {:.2f}] km'.format(
-        fit_result[0],
-        min_distance,
-        max_distance))
-
-    phase = fit_result[3]
-    tau = 2 * np.pi
-    while phase > tau:
-        phase -= tau
-    while phase < 0:
-        phase += tau
-
-    if options.improve and pair.has_full_fit:
-        def close(a, b):
-            return (a-b)/b <= 0.01
-
-        small_difference = all((
-            close(fit_result[0], pair.fit_period_u),
-            close(pair.fit_min_distance_km, min_distance),
-            close(pair.fit_max_distance_km, max_distance),
-            close(pair.fit_phase, phase),
-        ))
-        if small_difference:
-            print('Detected only small difference, writing automatically')
-            pair.fit_period_u = fit_result[0]
-            pair.fit_min_distance_km = min_distance
-            pair.fit_max_distance_km = max_distance
-            pair.fit_phase = phase
-            return True
-        
-    if not interactive:
-        return False
+
+    result = fit_pair(pair.id, x, y, (period, amplitude, baseline, phase), fudge_factor)
+    print_result(pair, result)
+    if result['period'] is None:
+        return
+
+    if options.improve and is_small_difference(pair, result):
+        print('Detected only small difference, writing automatically')
+        apply_fit(pair, result, last_reading_id)
+        return
+
     # regularized grid for plotting
     xr = np.linspace(min(x), max(x), 50 * len(x))
-    plt.plot(xr, f(xr, *fit_result), 'b-')
-    
+    baseline = (result['max_distance'] ** 2 + result['min_distance'] ** 2) / 2
+    amplitude = (result['max_distance'] ** 2 - result['min_distance'] ** 2) / 2
+    plt.plot(xr, squared_distance(xr, result['period'], amplitude, baseline, result['phase']), 'b-')
+
     plt.gcf().set_size_inches(12, 9)
     plt.title(str(pair))
     plt.plot(x, y, 'ro')
     plt.show()
 
     if input('Write (y/n)? ') == 'y':
-        pair.fit_period_u = fit_result[0]
-        pair.fit_min_distance_km = min_distance
-        pair.fit_max_distance_km = max_distance
-        pair.fit_phase = phase
+        apply_fit(pair, result, last_reading_id)
         db.session.commit()
         print('... saved. Bye.')
 
+
+def improve_all():
+    query = StationPair.query.options(db.joinedload(StationPair.station_a), db.joinedload(StationPair.station_b))
+    pairs = {pair.id: pair for pair in query}
+    last_reading_id = last_reading_ids()
+    readings = load_readings()
+    failed = []
+    tasks = []
+    for pair_id, pair in pairs.items():
+        if pair_id not in readings:
+            continue
+        x, y = readings[pair_id]
+        initial = initial_parameters(pair, y)
+        if not initial[0]:
+            failed.append((pair, 'no initial period, fit it interactively first'))
+            continue
+        tasks.append((pair_id, x, y, initial))
+
+    print('Fitting {} pairs'.format(len(tasks)))
+    for result in fit_pairs(tasks, options.jobs):
+        pair = pairs[result['pair_id']]
+        print('{:5d}  {:50}  {:6d} readings  {:7.2f}s  {}'.format(
+            pair.id,
+            str(pair),
+            result['count'],
+            result['seconds'],
+            'converged' if result['converged'] else 'FAILED: {}'.format(result['message']),
+        ))
+        if is_small_difference(pair, result):
+            apply_fit(pair, result, last_reading_id[pair.id])
+        else:
+            failed.append((pair, 'large difference' if result['converged'] else result['message']))
+
+    if failed:
+        print('\n\nFAILED:')
+        for pair, reason in failed:
+            print('   {}  {}  ({})'.format(pair.id, pair, reason))
+
+
 with app.app_context():
     if options.all:
-        failed = []
-        for pair in StationPair.query:
-            success = improve_one(pair, interactive=False)
-            if not success:
-                failed.append(pair)
-        if failed:
-            print('\n\nFAILED:')
-            for pair in failed:
-                print('   {}  {}'.format(pair.id, pair))
-            
+        improve_all()
     else:
         pair = StationPair.query.filter_by(id=options.station_id).one()
         improve_one(pair)
 
     if options.improve:
         db.session.commit()
-
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Compares the scalar GCT conversion functions with their vectorized
+counterparts in utt.gct.
+"""
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from utt.gct import (
+    as_gct,
+    parse_gct,
+    format_gct_units,
+    gct_units_from_datetime64,
+    gct_units_from_datetimes,
+    parse_gct_units,
+)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of GCT conversions')
+    parser.add_argument('-n', '--count', type=int, default=100000, help='Number of timestamps')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    return parser.parse_args()
+
+options = parse_args()
+
+start = datetime(2019, 1, 1, tzinfo=timezone.utc)
+dts = [start + timedelta(seconds=random.uniform(0, 5 * 365 * 86400)) for _ in range(options.count)]
+dt64 = np.array([dt.replace(tzinfo=None) for dt in dts], dtype='datetime64[us]')
+units = gct_units_from_datetime64(dt64)
+strings = [as_gct(dt) + ' GCT' for dt in dts]
+
+cases = [
+    ('datetime -> units',  lambda: [float(as_gct(dt, format=False)) for dt in dts],
+                           lambda: gct_units_from_datetimes(dts)),
+    ('datetime64 -> units', lambda: [float(as_gct(dt, format=False)) for dt in dts],
+                           lambda: gct_units_from_datetime64(dt64)),
+    ('format',             lambda: [as_gct(dt) for dt in dts],
+                           lambda: format_gct_units(units)),
+    ('parse',              lambda: [parse_gct(s) for s in strings],
+                           lambda: parse_gct_units(strings)),
+]
+
+print('{} timestamps, best of {} runs'.format(options.count, options.repeat))
+print('{:22} {:>12} {:>12} {:>9}'.format('', 'scalar/ms', 'vector/ms', 'speedup'))
+for name, scalar, vector in cases:
+    t_scalar = min(timeit.repeat(scalar, number=1, repeat=options.repeat)) * 1000
+    t_vector = min(timeit.repeat(vector, number=1, repeat=options.repeat)) * 1000
+    print('{:22} {:12.2f} {:12.2f} {:8.1f}x'.format(name, t_scalar, t_vector, t_scalar / t_vector))
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the ingest endpoints.
+
+Seeds a scratch database with synthetic data in realistic volumes, then
+replays POST requests shaped like those of tau-tracker.user.js against the
+application (through the Flask test client, so without network overhead),
+and reports latency percentiles, SQL statements per request and throughput
+per endpoint. Run it before and after a change to catch regressions:
+
+    $ createdb utt_bench
+    $ export UTT_DATABASE_URI=postgresql:///utt_bench
+    $ python benchmark-ingest.py --seed --scale 1
+    $ python benchmark-ingest.py --requests 500
+
+Never point it at the production database: seeding adds millions of rows.
+"""
+import argparse
+import contextlib
+import io
+import random
+import string
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import event
+
+from utt.gct import as_gct
+from utt.model import (
+    db,
+    CareerBatchSubmission,
+    CareerTask,
+    CareerTaskReading,
+    Character,
+    FuelPriceReading,
+    FuelPriceSummary,
+    Item,
+    ItemRarity,
+    ItemType,
+    Ship,
+    ShipClass,
+    ShipSighting,
+    ShipSightingStreak,
+    ShipSummary,
+    Station,
+    StationDistanceReading,
+    StationPair,
+    StationPairSummary,
+    System,
+    Token,
+    Vendor,
+    VendorInventory,
+    VendorInventoryItem,
+    VendorItemPriceReading,
+)
+from utt import app
+
+careers = ['Business', 'Clone Care', 'Medicine', 'Security', 'Space Operations']
+tasks_per_career = 8
+vendors_per_station = 3
+items_per_inventory = 20
+ship_classes = ['Heavy Freighter', 'Interceptor', 'Shuttle', 'Yacht']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Seed a scratch database and benchmark the ingest endpoints')
+    parser.add_argument('--seed', action='store_true', help='Fill the (empty) database with synthetic data first')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Data volume for --seed; 1 means about 2 million distance readings')
+    parser.add_argument('--requests', '-n', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--endpoint', action='append', help='Only benchmark these endpoints (repeatable)')
+    parser.add_argument('--random-seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help='Run against the default database anyway')
+    return parser.parse_args()
+
+options = parse_args()
+rng = random.Random(options.random_seed)
+
+def random_name(k=8):
+    return ''.join(rng.choices(string.ascii_lowercase, k=k)).capitalize()
+
+def insert_chunked(model, rows, chunk_size=10000):
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(model.__table__.insert(), rows[start:start + chunk_size])
+
+## Seeding
+
+def seed(scale):
+    db.create_all()
+    assert not System.query.first(), 'Database is not empty, refusing to seed'
+    n_systems = 10
+    n_stations = 8
+    n_characters = max(int(200 * scale), 2)
+    n_distance = int(2_000_000 * scale)
+    n_fuel = int(200_000 * scale)
+    n_ships = max(int(5000 * scale), 1)
+    n_sightings = int(500_000 * scale)
+    n_items = 500
+    n_career = int(100_000 * scale)
+    n_vendor_days = max(int(90 * scale), 1)
+
+    print('Seeding characters, systems and stations')
+    characters = [Character(name='bench-{}'.format(i)) for i in range(n_characters)]
+    tokens = [Token(character=c, token='bench-token-{}'.format(i)) for i, c in enumerate(characters)]
+    db.session.add_all(characters + tokens)
+    systems = [System(name='System {}'.format(i), rank=i + 1) for i in range(n_systems)]
+    stations = []
+    for system in systems:
+        for i in range(n_stations):
+            name = '{} Station {}'.format(system.name, i)
+            stations.append(Station(system=system, name=name, name_lower=name.lower(), level=rng.randint(1, 30)))
+    db.session.add_all(systems + stations)
+    db.session.flush()
+    pairs = []
+    for system in systems:
+        in_system = sorted((s for s in stations if s.system is system), key=lambda s: s.name_lower)
+        for i, a in enumerate(in_system):
+            for b in in_system[i + 1:]:
+                pairs.append(StationPair(system=system, station_a=a, station_b=b))
+    db.session.add_all(pairs)
+    db.session.flush()
+    token_ids = [t.id for t in tokens]
+
+    print('Seeding {} distance readings'.format(n_distance))
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    per_pair = max(n_distance // len(pairs), 1)
+    for pair in pairs:
+        period = rng.uniform(1, 20) * 86400
+        base, amplitude = rng.uniform(1e6, 5e6), rng.uniform(1e5, 1e6)
+        seconds = np.sort(np.random.uniform(0, 365 * 86400, per_pair))
+        distance = base + amplitude * np.cos(2 * np.pi * seconds / period)
+        insert_chunked(StationDistanceReading, [
+            {
+                'station_pair_id': pair.id,
+                'distance_km': int(d),
+                'when': start + timedelta(seconds=float(s)),
+                'token_id': rng.choice(token_ids),
+            }
+            for s, d in zip(seconds, distance)
+        ])
+
+    print('Seeding {} fuel price readings'.format(n_fuel))
+    prices = np.random.uniform(0.5, 5, n_fuel)
+    insert_chunked(FuelPriceReading, [
+        {
+            'station_id': rng.choice(stations).id,
+            'when': start + timedelta(seconds=rng.uniform(0, 365 * 86400)),
+            'fuel_g': 1000.0,
+            'price': price * 1000,
+            'price_per_g': price,
+            'token_id': rng.choice(token_ids),
+        }
+        for price in prices.tolist()
+    ])
+
+    print('Seeding {} ships with {} sightings'.format(n_ships, n_sightings))
+    classes = [ShipClass(name=name) for name in ship_classes]
+    db.session.add_all(classes)
+    db.session.flush()
+    insert_chunked(Ship, [
+        {
+            'registration': 'BENCH-{:06d}'.format(i),
+            'name': random_name(),
+            'captain': random_name(),
+            'ship_class_id': rng.choice(classes).id,
+        }
+        for i in range(n_ships)
+    ])
+    ship_ids = [ship_id for ship_id, in db.session.query(Ship.id)]
+    insert_chunked(ShipSighting, [
+        {
+            'ship_id': rng.choice(ship_ids),
+            'station_id': rng.choice(stations).id,
+            'when': start + timedelta(seconds=rng.uniform(0, 365 * 86400)),
+            'token_id': rng.choice(token_ids),
+        }
+        for _ in range(n_sightings)
+    ])
+
+    print('Seeding {} items'.format(n_items))
+    rarity = ItemRarity(name='common')
+    item_type = ItemType(name='food')
+    db.session.add_all([rarity, item_type])
+    db.session.flush()
+    insert_chunked(Item, [
+        {
+            'name': 'Bench Item {}'.format(i),
+            'slug': 'bench-item-{}'.format(i),
+            'mass_kg': 1.0,
+            'tier': rng.randint(1, 6),
+            'token_id': token_ids[0],
+            'item_type_id': item_type.id,
+            'rarity_id': rarity.id,
+        }
+        for i in range(n_items)
+    ])
+
+    print('Seeding {} career batch submissions'.format(n_career))
+    tasks = [CareerTask(name='{} task {}'.format(career, i), career=career, bonus_baseline=9.0)
+             for career in careers for i in range(tasks_per_career)]
+    db.session.add_all(tasks)
+    db.session.flush()
+    character_ids = [c.id for c in characters]
+    insert_chunked(CareerBatchSubmission, [
+        {
+            'token_id': token_ids[i % len(token_ids)],
+            'character_id': character_ids[i % len(character_ids)],
+            'station_id': rng.choice(stations).id,
+            'career': rng.choice(careers),
+            'rank': 'Rank {}'.format(rng.randint(1, 10)),
+            'when': start + timedelta(seconds=rng.uniform(0, 365 * 86400)),
+            'factor': rng.uniform(1, 2),
+        }
+        for i in range(n_career)
+    ])
+    tasks_by_career = defaultdict(list)
+    for task in tasks:
+        tasks_by_career[task.career].append(task)
+    readings = []
+    for batch_id, career in db.session.query(CareerBatchSubmission.id, CareerBatchSubmission.career):
+        for task in rng.sample(tasks_by_career[career], rng.randint(3, tasks_per_career)):
+            bonus = round(rng.uniform(9, 18), 2)
+            readings.append({
+                'batch_submission_id': batch_id,
+                'career_task_id': task.id,
+                'bonus': bonus,
+                'factor': bonus / task.bonus_baseline,
+            })
+    insert_chunked(CareerTaskReading, readings)
+
+    print('Seeding vendors with {} days of prices'.format(n_vendor_days))
+    vendors = [Vendor(station=station, name='Bench Vendor {}'.format(i + 1))
+               for station in stations for i in range(vendors_per_station)]
+    db.session.add_all(vendors)
+    db.session.flush()
+    item_ids = [item_id for item_id, in db.session.query(Item.id).filter(Item.slug.like('bench-item-%'))]
+    inventories = [VendorInventory(vendor=vendor, token_id=rng.choice(token_ids),
+                                   first_seen=start, last_seen=datetime.now(timezone.utc))
+                   for vendor in vendors]
+    db.session.add_all(inventories)
+    db.session.flush()
+    inventory_items = []
+    prices = []
+    today = datetime.now(timezone.utc).date()
+    for inventory in inventories:
+        for item_id in rng.sample(item_ids, items_per_inventory):
+            inventory_items.append({'vendor_inventory_id': inventory.id, 'item_id': item_id})
+            base_price = rng.uniform(1, 1000)
+            for days_ago in range(1, n_vendor_days + 1):
+                prices.append({
+                    'vendor_id': inventory.vendor_id,
+                    'vendor_inventory_id': inventory.id,
+                    'item_id': item_id,
+                    'token_id': rng.choice(token_ids),
+                    'day': today - timedelta(days=days_ago),
+                    'price_credits': round(base_price * rng.uniform(0.9, 1.1), 2),
+                    'price_bonds': None,
+                })
+    insert_chunked(VendorInventoryItem, inventory_items)
+    insert_chunked(VendorItemPriceReading, prices)
+
+    print('Rebuilding summaries')
+    FuelPriceSummary.rebuild()
+    StationPairSummary.rebuild()
+    ShipSightingStreak.rebuild()
+    ShipSummary.rebuild()
+    db.session.commit()
+
+## Payloads, shaped like the ones of tau-tracker.user.js
+
+class Payloads:
+    def __init__(self):
+        self.tokens = [t for t, in db.session.query(Token.token).filter(Token.token.like('bench-token-%'))]
+        assert self.tokens, 'No benchmark tokens found, run with --seed first'
+        self.stations = [(system, station) for station, system in
+                         db.session.query(Station.name, System.name).join(System, Station.system_id == System.id)]
+        self.by_system = defaultdict(list)
+        for system, station in self.stations:
+            self.by_system[system].append(station)
+        self.registrations = [r for r, in db.session.query(Ship.registration).limit(2000)]
+        self.slugs = [s for s, in db.session.query(Item.slug).filter(Item.slug.like('bench-item-%'))]
+        # (system, station, vendor) => item slugs of the current inventory
+        self.inventories = defaultdict(list)
+        current = db.session.query(System.name, Station.name, Vendor.name, Item.slug) \
+            .join(Station, Station.system_id == System.id) \
+            .join(Vendor, Vendor.station_id == Station.id) \
+            .join(VendorInventory, VendorInventory.vendor_id == Vendor.id) \
+            .join(VendorInventoryItem, VendorInventoryItem.vendor_inventory_id == VendorInventory.id) \
+            .join(Item, Item.id == VendorInventoryItem.item_id) \
+            .filter(VendorInventory.is_current == True, Vendor.name.like('Bench Vendor %'))
+        for system, station, vendor, slug in current:
+            self.inventories[(system, station, vendor)].append(slug)
+        self.item_count = 0
+
+    def common(self):
+        system, station = rng.choice(self.stations)
+        return {'token': rng.choice(self.tokens), 'system': system, 'station': station,
+                'script_version': '1.0'}
+
+    def distance(self):
+        payload = self.common()
+        payload['source'] = payload.pop('station')
+        now = datetime.now(timezone.utc)
+        payload['schedules'] = [
+            {
+                'destination': destination,
+                'distances': [
+                    [as_gct(now + timedelta(minutes=15 * i)), rng.randint(1_000_000, 6_000_000),
+                     'D/0{}:{:03d}'.format(rng.randint(1, 9), rng.randint(0, 999)), rng.uniform(50, 500)]
+                    for i in range(4)
+                ],
+            }
+            for destination in self.by_system[payload['system']] if destination != payload['source']
+        ]
+        return payload
+
+    def fuel(self):
+        payload = self.common()
+        fuel_g = rng.choice([100, 1000, 5000])
+        payload.update(fuel_g=fuel_g, price=round(fuel_g * rng.uniform(0.5, 5), 2))
+        return payload
+
+    def career_task(self):
+        payload = self.common()
+        career = rng.choice(careers)
+        payload.update(career=career, rank='Rank {}'.format(rng.randint(1, 10)), tasks={
+            '{} task {}'.format(career, i): round(rng.uniform(9, 40), 2)
+            for i in range(rng.randint(3, tasks_per_career))
+        })
+        return payload
+
+    def ship(self):
+        payload = self.common()
+        payload['ships'] = [
+            {
+                'registration': registration,
+                'name': random_name(),
+                'captain': random_name(),
+                'class': rng.choice(ship_classes),
+            }
+            for registration in rng.sample(self.registrations, min(rng.randint(1, 30), len(self.registrations)))
+        ]
+        return payload
+
+    def vendor_inventory(self):
+        payload = self.common()
+        payload['vendor'] = 'Bench Vendor {}'.format(rng.randint(1, vendors_per_station))
+        slugs = self.inventories.get((payload['system'], payload['station'], payload['vendor']))
+        # most submissions repeat the current inventory, some change it
+        if not slugs or rng.random() < 0.1:
+            slugs = rng.sample(self.slugs, items_per_inventory)
+        payload['inventory'] = [
+            {'slug': slug, 'price': round(rng.uniform(1, 1000), 2), 'currency': 'credits'}
+            for slug in slugs
+        ]
+        return payload
+
+    def item(self):
+        self.item_count += 1
+        name = 'Bench New Item {} {}'.format(time.time(), self.item_count)
+        return {
+            'token': rng.choice(self.tokens),
+            'name': name,
+            'slug': name.lower().replace(' ', '-'),
+            'mass_kg': rng.uniform(0.1, 10),
+            'tier': rng.randint(1, 6),
+            'rarity': 'common',
+            'type': 'food',
+        }
+
+endpoints = {
+    'distance': ('/v1/distance/add', Payloads.distance),
+    'fuel': ('/v1/fuel/add', Payloads.fuel),
+    'career-task': ('/v1/career-task/add', Payloads.career_task),
+    'ship': ('/v1/ship/add', Payloads.ship),
+    'vendor-inventory': ('/v1/vendor-inventory/add', Payloads.vendor_inventory),
+    'item': ('/v1/item/add', Payloads.item),
+}
+
+## Replay
+
+statement_count = 0
+
+def count_statement(*args):
+    global statement_count
+    statement_count += 1
+
+def succeeded(response):
+    """
+    The endpoints reject submissions with status 200 and `recorded` (or
+    `success`) false in the body, so the status alone is not enough.
+    """
+    if response.status_code != 200:
+        return False
+    body = response.get_json(silent=True)
+    if not isinstance(body, dict):
+        return True
+    return body.get('recorded', True) is not False and body.get('success', True) is not False
+
+def benchmark(client, url, make_payload, count):
+    global statement_count
+    latencies = []
+    statements = []
+    failures = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        payload = make_payload()
+        statement_count = 0
+        start = time.perf_counter()
+        # the endpoints print a line per request, which would drown the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = client.post(url, json=payload)
+        latencies.append(time.perf_counter() - start)
+        # requests share the app context of the benchmark, so discard the
+        # session like the end of a real request would, also after errors
+        db.session.remove()
+        statements.append(statement_count)
+        if not succeeded(response):
+            failures += 1
+    elapsed = time.perf_counter() - started
+    latencies = np.array(latencies) * 1000
+    return {
+        'p50': np.percentile(latencies, 50),
+        'p95': np.percentile(latencies, 95),
+        'p99': np.percentile(latencies, 99),
+        'queries': np.mean(statements),
+        'throughput': count / elapsed,
+        'failures': failures,
+    }
+
+
+with app.app_context():
+    assert options.force or app.config['SQLALCHEMY_DATABASE_URI'] != 'postgresql:///utt', \
+        'Set UTT_DATABASE_URI to a scratch database (or use --force)'
+    np.random.seed(options.random_seed)
+    if options.seed:
+        seed(options.scale)
+
+    payloads = Payloads()
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    client = app.test_client()
+    selected = options.endpoint or list(endpoints)
+
+    print('{} requests per endpoint'.format(options.requests))
+    print('{:18} {:>9} {:>9} {:>9} {:>9} {:>8} {:>6}'.format(
+        'endpoint', 'p50/ms', 'p95/ms', 'p99/ms', 'queries', 'req/s', 'fail'))
+    for name in selected:
+        url, make_payload = endpoints[name]
+        result = benchmark(client, url, lambda: make_payload(payloads), options.requests)
+        print('{:18} {p50:9.1f} {p95:9.1f} {p99:9.1f} {queries:9.1f} {throughput:8.1f} {failures:6d}'.format(
+            name, **result))
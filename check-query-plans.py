@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Runs EXPLAIN on the queries that the endpoints run on every request, and
+fails if any of them reads one of the big reading tables with a sequential
+scan, i.e. if no index supports it.
+
+Sequential scans are disabled for the session, so the planner only picks
+one if there is no usable index. This makes the check independent of the
+amount of data; it works on an empty scratch database, for example
+
+    $ createdb utt_plans
+    $ UTT_DATABASE_URI=postgresql:///utt_plans python check-query-plans.py --create
+"""
+import argparse
+import json
+import sys
+from datetime import date, datetime, timezone
+
+from utt.model import (
+    db,
+    CareerBatchSubmission,
+    FuelPriceReading,
+    ShipSightingStreak,
+    Station,
+    Token,
+    VendorItemPriceReading as VIPR,
+)
+from utt import app
+from utt.career import latest_factors_query, system_factors_query
+from utt.departure import latest_prices_query
+from utt.distance import pair_readings_query, stored_readings_query
+from utt.fit import readings_query
+
+# tables that must never be read with a sequential scan by a hot query
+checked_tables = {
+    'station_distance_reading',
+    'shuttle_price_reading',
+    'fuel_price_reading',
+    'career_batch_submission',
+    'ship_sighting',
+    'ship_sighting_streak',
+    'vendor_item_price_reading',
+    'token',
+}
+
+def hot_queries():
+    """
+    The queries are built by the same functions that the endpoints use, so
+    that this check follows them when they change. Queries that are still
+    written inline in the endpoints are mirrored here.
+    """
+    when = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    station = Station(id=1)
+    return {
+        'distance: new reading check': stored_readings_query([1, 2, 3], [when]),
+        'distance: pair chart': pair_readings_query(1, when),
+        'distance: pair readings': readings_query([1, 2, 3]),
+        'distance: latest shuttle prices': latest_prices_query([1, 2, 3]),
+        'fuel: station needs update': station.readings_today(FuelPriceReading, FuelPriceReading.station_id),
+        'career: station needs update': station.readings_today(CareerBatchSubmission,
+                                                               CareerBatchSubmission.station_id),
+        'career: system factors': system_factors_query(1, 1, when),
+        'career: summary': latest_factors_query(when),
+        'ship: latest streaks': ShipSightingStreak.latest_query([1, 2, 3]),
+        # mirrored from VendorInventory.last_price_for and vendor_inventory_add
+        'vendor: item prices of an inventory': VIPR.query
+            .filter_by(vendor_inventory_id=1, item_id=1).order_by(VIPR.day.desc()),
+        'vendor: prices of the day': VIPR.query.filter_by(vendor_inventory_id=1, day=date(2020, 1, 1)),
+        # mirrored from Token.verify
+        'token: verify': Token.query.filter_by(token='x', revoked=False),
+    }
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+def explain(connection, query):
+    compiled = query.statement.compile(dialect=connection.dialect)
+    result = connection.execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]['Plan']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Check that the hot queries use indexes')
+    parser.add_argument('--create', action='store_true',
+                        help='Create the tables first (for a scratch database)')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Print all query plans')
+    return parser.parse_args()
+
+options = parse_args()
+
+with app.app_context():
+    if options.create:
+        db.create_all()
+    connection = db.session.connection()
+    connection.execute('SET enable_seqscan = off')
+    failed = []
+    for name, query in hot_queries().items():
+        plan = explain(connection, query)
+        scans = sorted({node['Relation Name'] for node in plan_nodes(plan)
+                        if node['Node Type'] == 'Seq Scan' and node['Relation Name'] in checked_tables})
+        print('{:45}  {}'.format(name, 'SEQ SCAN on {}'.format(', '.join(scans)) if scans else 'ok'))
+        if options.verbose:
+            print(json.dumps(plan, indent=2))
+        if scans:
+            failed.append(name)
+    db.session.rollback()
+
+if failed:
+    print('\n{} queries without index support'.format(len(failed)))
+    sys.exit(1)
@@ -24,9 +24,21 @@ def insert(name):
     db.session.commit()
     print('{} - {}'.format(name, token_str))
 
+def revoke(tokens):
+    for token_str in tokens:
+        if Token.revoke(token_str):
+            print('Revoked {}'.format(token_str))
+        else:
+            print('No such token {}'.format(token_str))
+    db.session.commit()
+
 with app.app_context():
     db.create_all()
 
+    if name == '--revoke':
+        revoke(sys.argv[2:])
+        sys.exit(0)
+
     character = Character.query.filter_by(name=name).first()
     if character:
         print('Character {} already exists, with these tokens:'.format(name))
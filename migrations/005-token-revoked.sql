@@ -0,0 +1,2 @@
+ALTER TABLE token
+    ADD COLUMN revoked BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,33 @@
+CREATE TABLE fuel_price_summary (
+    station_id INTEGER PRIMARY KEY REFERENCES station (id) ON DELETE CASCADE,
+    last_reading TIMESTAMP WITH TIME ZONE NOT NULL,
+    min_price DOUBLE PRECISION NOT NULL,
+    max_price DOUBLE PRECISION NOT NULL,
+    last_price DOUBLE PRECISION NOT NULL
+);
+
+INSERT INTO fuel_price_summary (station_id, last_reading, min_price, max_price, last_price)
+SELECT DISTINCT ON (station_id)
+       station_id,
+       "when",
+       MIN(price_per_g) OVER (PARTITION BY station_id),
+       MAX(price_per_g) OVER (PARTITION BY station_id),
+       price_per_g
+  FROM fuel_price_reading
+ ORDER BY station_id, "when" DESC;
+
+DROP VIEW fuel_price_statistics;
+CREATE VIEW fuel_price_statistics (station_id, station_name, station_short_name, station_level, system_name, system_rank, last_reading, min_price, max_price, last_price) AS
+SELECT station.id,
+       station.name,
+       station.short,
+       station.level,
+       system.name,
+       system.rank,
+       fuel_price_summary.last_reading,
+       fuel_price_summary.min_price,
+       fuel_price_summary.max_price,
+       fuel_price_summary.last_price
+  FROM station
+  JOIN system ON station.system_id = system.id
+  JOIN fuel_price_summary ON station.id = fuel_price_summary.station_id;
@@ -0,0 +1,2 @@
+ALTER TABLE station_pair
+    ADD COLUMN fit_last_reading_id INTEGER;
@@ -0,0 +1,14 @@
+CREATE TABLE station_pair_summary (
+    station_pair_id INTEGER PRIMARY KEY REFERENCES station_pair (id) ON DELETE CASCADE,
+    reading_count INTEGER NOT NULL,
+    min_distance_km INTEGER NOT NULL,
+    max_distance_km INTEGER NOT NULL,
+    first_reading TIMESTAMP WITH TIME ZONE,
+    last_reading TIMESTAMP WITH TIME ZONE
+);
+
+INSERT INTO station_pair_summary (station_pair_id, reading_count, min_distance_km,
+                                  max_distance_km, first_reading, last_reading)
+SELECT station_pair_id, COUNT(*), MIN(distance_km), MAX(distance_km), MIN("when"), MAX("when")
+  FROM station_distance_reading
+ GROUP BY station_pair_id;
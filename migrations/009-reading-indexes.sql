@@ -0,0 +1,22 @@
+-- composite indexes for the lookups by parent and time that the endpoints
+-- run on every request. CONCURRENTLY doesn't work inside a transaction, so
+-- run this file with plain psql, without --single-transaction.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_station_distance_reading_station_pair_id_when
+    ON station_distance_reading (station_pair_id, "when");
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_shuttle_price_reading_route_when
+    ON shuttle_price_reading (source_station_id, destination_station_id, "when");
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_fuel_price_reading_station_id_when
+    ON fuel_price_reading (station_id, "when");
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_career_batch_submission_station_id_when
+    ON career_batch_submission (station_id, "when");
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ship_sighting_ship_id_when
+    ON ship_sighting (ship_id, "when");
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_vendor_item_price_reading_inventory_item_day
+    ON vendor_item_price_reading (vendor_inventory_id, item_id, day);
+
+ANALYZE station_distance_reading;
+ANALYZE shuttle_price_reading;
+ANALYZE fuel_price_reading;
+ANALYZE career_batch_submission;
+ANALYZE ship_sighting;
+ANALYZE vendor_item_price_reading;
@@ -0,0 +1,16 @@
+ALTER TABLE career_task_reading
+    ADD COLUMN factor DOUBLE PRECISION;
+
+UPDATE career_task
+   SET bonus_baseline = m.min_bonus
+  FROM (SELECT career_task_id, MIN(bonus) AS min_bonus
+          FROM career_task_reading
+         GROUP BY career_task_id) m
+ WHERE m.career_task_id = career_task.id
+   AND (career_task.bonus_baseline IS NULL OR career_task.bonus_baseline > m.min_bonus);
+
+UPDATE career_task_reading
+   SET factor = career_task_reading.bonus / career_task.bonus_baseline
+  FROM career_task
+ WHERE career_task.id = career_task_reading.career_task_id
+   AND career_task.bonus_baseline > 0;
@@ -0,0 +1,21 @@
+CREATE TABLE ship_sighting_streak (
+    id SERIAL PRIMARY KEY,
+    ship_id INTEGER NOT NULL REFERENCES ship (id),
+    station_id INTEGER NOT NULL REFERENCES station (id),
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    count INTEGER NOT NULL
+);
+
+CREATE INDEX ix_ship_sighting_streak_ship_id_last_seen
+    ON ship_sighting_streak (ship_id, last_seen);
+
+-- consecutive sightings at the same station have the same difference
+-- between their overall and their per-station row number
+INSERT INTO ship_sighting_streak (ship_id, station_id, first_seen, last_seen, count)
+SELECT ship_id, station_id, MIN("when"), MAX("when"), COUNT(*)
+  FROM (SELECT ship_id, station_id, "when",
+               ROW_NUMBER() OVER (PARTITION BY ship_id ORDER BY "when")
+             - ROW_NUMBER() OVER (PARTITION BY ship_id, station_id ORDER BY "when") AS streak
+          FROM ship_sighting) s
+ GROUP BY ship_id, station_id, streak;
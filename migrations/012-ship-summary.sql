@@ -0,0 +1,28 @@
+-- requires the streaks from 011-ship-sighting-streak.sql
+CREATE TABLE ship_summary (
+    ship_id INTEGER PRIMARY KEY REFERENCES ship (id) ON DELETE CASCADE,
+    last_station_id INTEGER NOT NULL REFERENCES station (id),
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_movement TIMESTAMP WITH TIME ZONE,
+    jump_count INTEGER NOT NULL,
+    sighting_count INTEGER NOT NULL
+);
+
+INSERT INTO ship_summary (ship_id, last_station_id, last_seen, last_movement,
+                          jump_count, sighting_count)
+SELECT ship_id,
+       MAX(CASE WHEN recency = 1 THEN station_id END),
+       MAX(last_seen),
+       MAX(CASE WHEN recency = 1 THEN previous_last_seen END),
+       COUNT(*) FILTER (WHERE system_id != previous_system_id),
+       SUM(count)
+  FROM (SELECT streak.ship_id, streak.station_id, streak.last_seen, streak.count,
+               station.system_id,
+               LAG(station.system_id) OVER w AS previous_system_id,
+               LAG(streak.last_seen) OVER w AS previous_last_seen,
+               ROW_NUMBER() OVER (PARTITION BY streak.ship_id
+                                  ORDER BY streak.first_seen DESC) AS recency
+          FROM ship_sighting_streak streak
+          JOIN station ON station.id = streak.station_id
+        WINDOW w AS (PARTITION BY streak.ship_id ORDER BY streak.first_seen)) s
+ GROUP BY ship_id;
@@ -6,10 +6,12 @@ from datetime import datetime, timedelta, timezone
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
+from sqlalchemy import extract
 
 from utt.model import db, StationPair, StationDistanceReading as SDR
 from utt import app
-from utt.gct import as_gct
+from utt.gct import as_gct, gct_units_from_epoch
+from utt.orbit import pair_distance
 
 
 
@@ -24,22 +26,15 @@ with app.app_context():
 
     start = datetime.now(timezone.utc)
     end  = start + timedelta(days=1)
-    readings = SDR.query.filter_by(station_pair_id=pair.id)\
-               .filter(SDR.when >=start, SDR.when < end).order_by(SDR.when)
-    x = []
-    y = []
-    for reading in readings:
-        x.append(float(as_gct(reading.when, format=False)))
-        y.append(float(reading.distance_km))
+    readings = db.session.query(extract('epoch', SDR.when), SDR.distance_km) \
+               .filter(SDR.station_pair_id == pair.id, SDR.when >=start, SDR.when < end).order_by(SDR.when)
+    readings = np.array(readings.all(), dtype=float).reshape(-1, 2)
+    x = gct_units_from_epoch(readings[:, 0])
+    y = readings[:, 1]
 
     xr = np.linspace(float(as_gct(start, format=False)), float(as_gct(end, format=False)), 1000)
 
-    maxs = pair.fit_max_distance_km ** 2
-    mins = pair.fit_min_distance_km ** 2
-
-    baseline =(maxs + mins) / 2
-    amplitude = (maxs - mins) / 2
-    yr = np.sqrt(baseline +  amplitude * np.cos(xr * (2 * np.pi / pair.fit_period_u) + pair.fit_phase))
+    yr = pair_distance(pair, xr)
 
     plt.plot(xr, yr, 'b-', label='predicted values')
 
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Rebuilds the summary tables that are otherwise maintained incrementally
+on ingest, for example after a backfill or manual edits of readings.
+"""
+import argparse
+
+from utt.model import db, CareerTask, FuelPriceSummary, ShipSightingStreak, ShipSummary, StationPairSummary
+from utt import app
+
+summaries = {
+    'career-factor': CareerTask.rebuild_baselines,
+    'fuel': FuelPriceSummary.rebuild,
+    'ship-streak': ShipSightingStreak.rebuild,
+    'ship-summary': ShipSummary.rebuild,
+    'station-pair': StationPairSummary.rebuild,
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Rebuild summary tables from the recorded readings')
+    parser.add_argument('summary', nargs='*',
+                        help='Summaries to rebuild, any of {} (default: all)'.format(', '.join(sorted(summaries))))
+    options = parser.parse_args()
+    unknown = set(options.summary) - set(summaries)
+    if unknown:
+        parser.error('Unknown summary: {}'.format(', '.join(sorted(unknown))))
+    return options
+
+options = parse_args()
+
+with app.app_context():
+    for name in options.summary or sorted(summaries):
+        print('Rebuilding {} summary'.format(name))
+        summaries[name]()
+    db.session.commit()
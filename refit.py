@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Refits only those station pairs that got new distance readings since their
+last fit. Meant to run as a scheduled job, for example from cron:
+
+    */30 * * * *  cd /path/to/utt && venv/bin/python refit.py
+"""
+import argparse
+
+from utt.model import db
+from utt import app
+from utt.fit import refit
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Refit station pairs with new readings')
+    parser.add_argument('--dry-run', action='store_true', help='Only report, do not write fits')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Number of worker processes (default: one per CPU)')
+    return parser.parse_args()
+
+options = parse_args()
+
+with app.app_context():
+    count = 0
+    written = 0
+    for pair, result, was_written in refit(jobs=options.jobs, write=not options.dry_run):
+        count += 1
+        written += was_written
+        if was_written:
+            status = 'written'
+        elif not result['converged']:
+            status = 'FAILED: {}'.format(result['message'])
+        else:
+            status = 'large difference, not written'
+        print('{:5d}  {:50}  {:6d} readings  {:7.2f}s  {}'.format(
+            pair.id, str(pair), result['count'], result['seconds'], status,
+        ))
+    print('Refitted {} pairs, wrote {}'.format(count, written))
+    if not options.dry_run:
+        db.session.commit()
@@ -1,7 +1,14 @@
 import os
-from utt.model import db
+import threading
+import time
+from collections import defaultdict
+from utt.cache import caches
+from utt.model import db, InvalidTokenException, Token
 from flask_cors import CORS
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, Response, g, has_request_context, request, render_template, send_from_directory
+from flask.signals import before_render_template, signals_available, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from .gct import as_gct
 import json
 
@@ -10,7 +17,7 @@ static_file_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'sta
 def make_app():
     app = Flask(__name__)
     #app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.environ.get('CTT_DB', '/tmp/utt.db')
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///utt'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('UTT_DATABASE_URI', 'postgresql:///utt')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     db.init_app(app)
     CORS(app)
@@ -19,6 +26,126 @@ def make_app():
 
 app = make_app()
 
+@app.before_request
+def keep_objects_after_ingest_commit():
+    # The ingest endpoints (the only POST routes) respond right after their
+    # commit, so expiring the objects they touched would only cause extra
+    # queries for the log line and the response. The session is removed at
+    # the end of the request, so this doesn't affect anything else.
+    if request.method == 'POST':
+        db.session().expire_on_commit = False
+
+## Instrumentation
+
+# requests slower than this many seconds are logged with their slowest statements
+slow_request_seconds = float(os.environ.get('UTT_SLOW_REQUEST_SECONDS', 1.0))
+
+# aggregates per route, exposed by /metrics
+metrics_lock = threading.Lock()
+route_metrics = defaultdict(lambda: {
+    'requests': 0,
+    'errors': 0,
+    'statements': 0,
+    'db_seconds': 0.0,
+    'template_seconds': 0.0,
+    'seconds': 0.0,
+})
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.statement_start = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'statements' in g:
+        g.statements.append((time.perf_counter() - g.statement_start, statement))
+
+def before_template(sender, template, context, **extra):
+    if has_request_context():
+        g.template_start = time.perf_counter()
+
+def after_template(sender, template, context, **extra):
+    if has_request_context() and 'template_start' in g:
+        g.template_seconds += time.perf_counter() - g.template_start
+
+if signals_available:
+    before_render_template.connect(before_template, app)
+    template_rendered.connect(after_template, app)
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.statements = []
+    g.template_seconds = 0.0
+    g.status_code = 500
+
+@app.after_request
+def record_status_code(response):
+    g.status_code = response.status_code
+    return response
+
+@app.teardown_request
+def record_request_metrics(exc):
+    if 'request_start' not in g:
+        return
+    seconds = time.perf_counter() - g.request_start
+    db_seconds = sum(duration for duration, _ in g.statements)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    with metrics_lock:
+        m = route_metrics[route]
+        m['requests'] += 1
+        m['errors'] += exc is not None or g.status_code >= 500
+        m['statements'] += len(g.statements)
+        m['db_seconds'] += db_seconds
+        m['template_seconds'] += g.template_seconds
+        m['seconds'] += seconds
+    if seconds >= slow_request_seconds:
+        print('SLOW REQUEST {} {} took {:.3f}s: {} statements in {:.3f}s, templates {:.3f}s'.format(
+            request.method, request.full_path, seconds, len(g.statements), db_seconds, g.template_seconds))
+        for duration, statement in sorted(g.statements, key=lambda s: s[0], reverse=True)[:5]:
+            print('    {:.3f}s  {}'.format(duration, ' '.join(statement.split())[:300]))
+
+def prometheus_escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+@app.route('/metrics')
+def metrics():
+    try:
+        token = Token.verify(request.args.get('token', ''))
+    except InvalidTokenException:
+        token = None
+    if not token or not token.full_read_permission:
+        return Response('Need a token with full read permission\n', status=403, mimetype='text/plain')
+
+    counters = [
+        ('requests', 'utt_requests_total', 'Requests handled'),
+        ('errors', 'utt_request_errors_total', 'Requests that failed with an exception or a 5xx status'),
+        ('statements', 'utt_db_statements_total', 'SQL statements executed'),
+        ('db_seconds', 'utt_db_seconds_total', 'Time spent executing SQL statements'),
+        ('template_seconds', 'utt_template_seconds_total', 'Time spent rendering templates'),
+        ('seconds', 'utt_request_seconds_total', 'Wall time spent handling requests'),
+    ]
+    with metrics_lock:
+        snapshot = {route: dict(m) for route, m in route_metrics.items()}
+    lines = []
+    for key, name, description in counters:
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} counter'.format(name))
+        for route, m in sorted(snapshot.items()):
+            lines.append('{}{{route="{}"}} {}'.format(name, prometheus_escape(route), m[key]))
+    for key, name, description in [('hits', 'utt_cache_hits_total', 'Cache hits'),
+                                   ('misses', 'utt_cache_misses_total', 'Cache misses')]:
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} counter'.format(name))
+        for cache_name, cache in sorted(caches.items()):
+            lines.append('{}{{cache="{}"}} {}'.format(name, prometheus_escape(cache_name), getattr(cache, key)))
+    lines.append('# HELP utt_cache_entries Entries currently in the cache')
+    lines.append('# TYPE utt_cache_entries gauge')
+    for cache_name, cache in sorted(caches.items()):
+        lines.append('utt_cache_entries{{cache="{}"}} {}'.format(prometheus_escape(cache_name), len(cache)))
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -0,0 +1,62 @@
+"""
+Small process-local caches for data that rarely changes, so that hot
+endpoints don't need to ask the database for it on every request.
+
+Every gunicorn worker has its own copy, so entries must either be safe to
+serve slightly stale (bounded by the TTL), or be invalidated explicitly by
+the code that changes the underlying data.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# all caches by name, for instrumentation
+caches = {}
+
+class TTLCache:
+    """
+    Cache whose entries expire `ttl` seconds after they were set. If
+    `maxsize` is given, the least recently used entries are evicted once
+    the cache grows beyond it. Hits and misses are counted.
+    """
+    def __init__(self, name, ttl, maxsize=None):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
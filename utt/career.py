@@ -2,11 +2,12 @@ from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 import json
 
-from flask import request, jsonify, Response, render_template
+from flask import request, jsonify, Response, render_template, abort
 from sqlalchemy import func
 
 from .app import app
-from utt.util import today_datetime
+from utt.cache import TTLCache
+from utt.util import today_datetime, today, tau_tz
 
 from utt.model import db, \
                       get_station, \
@@ -57,9 +58,11 @@ def career_task_add():
 
     factors = []
 
-    for task, bonus in payload['tasks'].items():
+    tasks = payload['tasks']
+    career_tasks = {ct.name: ct for ct in CareerTask.query.filter(CareerTask.name.in_(list(tasks)))}
+    for task, bonus in tasks.items():
         bonus = float(bonus)
-        career_task = CareerTask.query.filter_by(name=task).first()
+        career_task = career_tasks.get(task)
         if career_task is None:
             career_task = CareerTask(
                 name=task,
@@ -67,13 +70,15 @@ def career_task_add():
                 bonus_baseline=bonus,
             )
             db.session.add(career_task)
+            career_tasks[task] = career_task
         elif career_task.bonus_baseline is None or career_task.bonus_baseline > bonus:
-            career_task.bonus_baseline = bonus
-            
+            career_task.lower_baseline(bonus)
+
         tr = CareerTaskReading(
             batch_submission=batch,
             career_task=career_task,
             bonus=bonus,
+            factor=bonus / career_task.bonus_baseline,
         )
         db.session.add(tr)
         f = tr.factor
@@ -93,20 +98,9 @@ def career_task_add():
     response['recorded'] = True
     response['factor'] = factor
 
-    # find factors for other stations in the system
-    date_limit = today_datetime()
-    stations = Station.query.filter_by(system_id=station.system_id)
-    system_factors = {}
-
-    cbs = CareerBatchSubmission
-    for st in stations.all():
-        if st.name == station_name:
-            continue
-        qry = cbs.query.filter(cbs.when > date_limit).filter_by(station_id=st.id).order_by(cbs.when.desc())
-        bs = qry.first()
-        if bs:
-            factor = max(o.factor for o in bs.readings)
-            system_factors[st.name] = factor
+    # find today's factors for other stations in the system
+    latest = system_factors_query(station.system_id, station.id, today_datetime())
+    system_factors = {name: factor for name, factor in latest}
     if system_factors:
         response['system_factors'] = system_factors
   
@@ -114,34 +108,66 @@ def career_task_add():
 
     return jsonify(response)
 
+def system_factors_query(system_id, station_id, since):
+    """
+    Station name and factor of the latest batch since `since` of every
+    station in the system except `station_id`.
+    """
+    CBS = CareerBatchSubmission
+    return db.session.query(Station.name, CBS.factor) \
+        .join(Station, CBS.station_id == Station.id) \
+        .filter(Station.system_id == system_id,
+                CBS.station_id != station_id,
+                CBS.when > since,
+                CBS.factor != None) \
+        .distinct(CBS.station_id) \
+        .order_by(CBS.station_id, CBS.when.desc())
+
+def latest_factors_query(since):
+    """
+    System name, station name and factor of the latest batch since `since`
+    of every station.
+    """
+    CBS = CareerBatchSubmission
+    return db.session.query(System.name, Station.name, CBS.factor) \
+        .join(Station, CBS.station_id == Station.id) \
+        .join(System, Station.system_id == System.id) \
+        .filter(CBS.factor != None, CBS.when > since) \
+        .distinct(CBS.station_id) \
+        .order_by(CBS.station_id, CBS.when.desc())
+
+# rendered summary, keyed on the highest batch ID, so a new batch from any
+# worker process leads to a re-render; the short TTL makes stations drop out
+# of the summary when their factor gets too old
+summary_cache = TTLCache('career_summary', ttl=60, maxsize=2)
+
+def summary_text():
+    """
+    Latest factor per station, for stations with a factor from the last
+    six hours, with a single DISTINCT ON query.
+    """
+    rows = latest_factors_query(now() - timedelta(hours=6))
+    return ''.join('{:.2f}  {:20} {:30}\n'.format(factor, system, station)
+                   for system, station, factor in sorted(rows, key=lambda r: (r[0], r[1])))
+
 @app.route('/v1/career-task/summary')
 def summary():
     token_str = request.args.get('token')
     assert token_str, 'Missing token'
-    token = Token.query.filter_by(token=token_str).first()
+    try:
+        token = Token.verify(token_str)
+    except InvalidTokenException:
+        token = None
     assert token, 'Invalid token'
     assert token.full_read_permission, 'Permission denied'
 
-    stations = Station.query.all()
-
-    factors = defaultdict(dict) # factors = {'YC Ceti': {'Cape Verde Stronghold': 1.25}}
-
-    for station in stations:
-        bs = CareerBatchSubmission.query.filter_by(station_id=station.id).filter(CareerBatchSubmission.factor != None).order_by(CareerBatchSubmission.when.desc()).first()
-        if not bs:
-            continue
-        if (now() - bs.when).total_seconds() > 6 * 3600:
-            continue
-        factors[station.system.name][station.name] = bs.factor
-
-    result = ''
-    for system in sorted(factors.keys()):
-        for station in sorted(factors[system].keys()):
-            factor = factors[system][station]
-            result += '{:.2f}  {:20} {:30}\n'.format(factor, system, station)
+    key = db.session.query(func.max(CareerBatchSubmission.id)).scalar()
+    result = summary_cache.get(key)
+    if result is None:
+        result = summary_text()
+        summary_cache.set(key, result)
 
     return Response(result, mimetype='text/plain')
-            
 
 @app.route('/v1/career-task/stats-by-character')
 def career_stats_by_player():
@@ -167,30 +193,63 @@ def career_overview():
 
     return render_template('career_overview.html', systems=systems)
 
+# days shown by default in the career factor chart
+career_graph_days = 90
+
+def parse_date_arg(name, default):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        abort(400, 'Invalid date {!r} for {}, expected YYYY-MM-DD'.format(value, name))
+
+def tau_day_start(day):
+    """
+    Start of a day in Tau Station's timezone, as a UTC datetime.
+    """
+    return tau_tz.localize(datetime(day.year, day.month, day.day)).astimezone(timezone.utc)
+
 @app.route('/career/system/<id>')
 def system_career_graph(id):
     system = System.query.filter_by(id=id).one()
     stations = system.stations
-    limit = today_datetime()
-    datasets = []
+    # today's factors are still incomplete
+    to_date = parse_date_arg('to', today() - timedelta(days=1))
+    from_date = parse_date_arg('from', to_date - timedelta(days=career_graph_days - 1))
+
+    # maximal factor per station and day
     CBS = CareerBatchSubmission
+    day = func.date(func.timezone(tau_tz.zone, CBS.when))
+    rows = db.session.query(CBS.station_id, day, func.max(CBS.factor)) \
+        .join(Station, CBS.station_id == Station.id) \
+        .filter(Station.system_id == system.id,
+                CBS.factor != None,
+                CBS.when >= tau_day_start(from_date),
+                CBS.when < tau_day_start(to_date + timedelta(days=1))) \
+        .group_by(CBS.station_id, day) \
+        .order_by(CBS.station_id, day)
+    by_station = defaultdict(list)
+    for station_id, d, factor in rows:
+        by_station[station_id].append({'x': str(d), 'y': factor})
+
+    datasets = []
     # colors from https://htmlcolorcodes.com/color-chart/
     colors = '#cd6155 #9b59b6 #2980b9 #1abc9c #16a085 #f1c40f #f39c12 #7f8c8d #f1948a #85c1e9'.split(' ')
     for idx, station in enumerate(stations):
-        data = []
-        q = CBS.query.filter(CBS.station_id == station.id, CBS.when <= limit).order_by(CBS.when)
-        for batch in q:
-            if batch.factor:
-                data.append({'x': batch.when.strftime( "%Y-%m-%dT%H:%M:%SZ"), 'y': batch.factor})
+        data = by_station.get(station.id)
         if data:
             datasets.append({
                 'label': station.name,
                 'data': data,
-                'backgroundColor': colors[idx],
+                'backgroundColor': colors[idx % len(colors)],
             })
     ctx = {
         'system': system,
         'datasets': json.dumps(datasets),
-        'systems': System.query.all()
+        'systems': System.query.all(),
+        'from_date': from_date,
+        'to_date': to_date,
     }
     return render_template('system_career_factor.html', **ctx)
@@ -0,0 +1,128 @@
+"""
+Index of the upcoming cheapest departure windows between the stations of a
+system.
+
+Shuttle fares are the distance times a per-route price ratio, so the
+cheapest (and fastest) flights depart around the minima of the distance
+between two stations. The index holds the closed-form minima of all fitted
+pairs of a system for the next `horizon_days`, so that a lookup is just a
+binary search.
+"""
+from datetime import datetime, timezone
+
+import numpy as np
+
+from utt.cache import TTLCache
+from utt.gct import as_gct, format_gct_units
+from utt.model import db, StationPair, ShuttlePriceReading as SPR
+from utt.orbit import pair_minima
+
+# longest lookahead of a lookup, in GCT days
+horizon_days = 30
+# indexes cover this much more than `horizon_days`, so that one built a
+# while ago still serves the longest lookahead until its cache entry expires
+margin_days = 1
+units_per_day = 100_000
+
+# Fits only change through the offline fitting scripts, so indexes are
+# rebuilt after a while instead of being invalidated
+departure_index_cache = TTLCache('departure_index', ttl=600)
+
+def now_u():
+    return float(as_gct(datetime.now(timezone.utc), format=False))
+
+
+class DepartureIndex:
+    def __init__(self, system_id, start, end, windows, prices):
+        self.system_id = system_id
+        self.start = start
+        self.end = end
+        # (lower station ID, higher station ID) => (min distance, minima, window starts, window ends)
+        self.windows = windows
+        # (source station ID, destination station ID) => latest price per km
+        self.prices = prices
+
+    def price_per_distance(self, source_id, destination_id):
+        price = self.prices.get((source_id, destination_id))
+        if price is None:
+            price = self.prices.get((destination_id, source_id))
+        return price
+
+    def departures(self, source_id, destination_id, start, end):
+        """
+        Returns the departure windows from `source_id` to `destination_id`
+        that have not ended by GCT units `start` and whose minimum is before
+        `end`, ordered by time, each as a dict with the time of the minimum,
+        the window, the distance and the estimated fare (or `None` if no
+        price is known). Returns `None` if the pair has no fit.
+        """
+        entry = self.windows.get(tuple(sorted((source_id, destination_id))))
+        if entry is None:
+            return None
+        min_distance, minima, window_from, window_to = entry
+        first = np.searchsorted(window_to, start, side='right')
+        last = np.searchsorted(minima, end, side='right')
+        price = self.price_per_distance(source_id, destination_id)
+        gct = format_gct_units(minima[first:last] + 0.5)
+        return [
+            {
+                'u': float(minima[i]),
+                'gct': gct[i - first],
+                'window_from': float(window_from[i]),
+                'window_to': float(window_to[i]),
+                'distance_km': min_distance,
+                'estimated_price': price and round(price * min_distance, 2),
+            }
+            for i in range(first, last)
+        ]
+
+
+def latest_prices_query(station_ids):
+    """
+    Latest shuttle price per km of every route from one of `station_ids`.
+    """
+    return db.session.query(SPR.source_station_id, SPR.destination_station_id, SPR.price_per_distance) \
+        .filter(SPR.source_station_id.in_(station_ids)) \
+        .distinct(SPR.source_station_id, SPR.destination_station_id) \
+        .order_by(SPR.source_station_id, SPR.destination_station_id, SPR.when.desc())
+
+def build_departure_index(system_id, start=None):
+    """
+    Builds the index of a system from `start` (default: now) for
+    `horizon_days` plus `margin_days`, with one query for the pair fits and
+    one for the latest shuttle price of each route.
+    """
+    if start is None:
+        start = now_u()
+    end = start + (horizon_days + margin_days) * units_per_day
+
+    windows = {}
+    SP = StationPair
+    pairs = SP.query.filter(SP.system_id == system_id,
+                            SP.fit_period_u != None,
+                            SP.fit_min_distance_km != None,
+                            SP.fit_max_distance_km != None,
+                            SP.fit_phase != None)
+    for pair in pairs:
+        # include the window around a minimum just before `start`
+        minima, window_from, window_to = pair_minima(pair, start - pair.fit_period_u, end)
+        key = tuple(sorted((pair.station_a_id, pair.station_b_id)))
+        windows[key] = (pair.fit_min_distance_km, minima, window_from, window_to)
+
+    prices = {}
+    if windows:
+        station_ids = {station_id for key in windows for station_id in key}
+        prices = {(source, destination): price
+                  for source, destination, price in latest_prices_query(station_ids)}
+
+    return DepartureIndex(system_id, start, end, windows, prices)
+
+def get_departure_index(system_id, days):
+    """
+    Returns a departure index of the system that covers the next `days`.
+    """
+    index = departure_index_cache.get(system_id)
+    if index is None or index.end < now_u() + days * units_per_day:
+        index = build_departure_index(system_id)
+        departure_index_cache.set(system_id, index)
+    return index
@@ -1,4 +1,3 @@
-import pytz
 import json
 import re
 import math
@@ -6,27 +5,32 @@ from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
 
 
-from flask import request, jsonify, Response, url_for, render_template, send_file
-from sqlalchemy import func
+from flask import request, jsonify, Response, url_for, render_template, stream_with_context
+from sqlalchemy import extract, func
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg
 
 from .app import app
 
-from utt.gct import as_gct, parse_gct, gct_duration
+from utt.cache import TTLCache
+from utt.departure import get_departure_index, horizon_days, now_u, units_per_day
+from utt.orbit import get_system_orbits, pair_distance, pair_minima
+from utt.plot import cache_key_part, png_response, render_prediction, render_system
+from utt.gct import as_gct, parse_gct, gct_duration, gct_units_from_epoch, format_gct_units, parse_gct_units
 from utt.model import (
     db,
     get_station,
-    get_station_pair,
+    get_stations,
+    get_station_pairs_from,
     System,
     Station,
     Character,
     Token,
     ShuttlePriceReading,
     StationPair,
+    StationPairSummary,
     StationDistanceReading,
     InvalidTokenException,
 )
@@ -47,15 +51,24 @@ def add_distance():
         return jsonify({'recorded': False, 'message': 'Invalid token'})
 
     station = get_station(payload['system'], payload['source'])
+    schedules = []
+    for schedule in payload['schedules']:
+        distances = [t for t in schedule['distances'] if t[0] and t[1]]
+        if distances:
+            schedules.append((schedule['destination'], distances))
+
+    # resolve all destinations and pairs up front instead of once per schedule
+    destinations = get_stations(payload['system'], [name for name, _ in schedules])
+    pairs = get_station_pairs_from(station, set(destinations.values()))
+    db.session.flush()
+
     count = 0
     new = 0
     price_count = 0
-    for schedule in payload['schedules']:
-        distances = [t for t in schedule['distances'] if t[0] and t[1]]
-        if not distances:
-            continue
-        destination = get_station(payload['system'], schedule['destination'])
-        pair = get_station_pair(station, destination)
+    readings = []
+    for destination_name, distances in schedules:
+        destination = destinations[destination_name]
+        pair = pairs[destination]
         first_price_ratio = None
         for d_tuple  in distances:
             
@@ -78,25 +91,17 @@ def add_distance():
                 first_price_ratio = price / distance
 
             count += 1
-            existing = StationDistanceReading.query.filter_by(
-                station_pair_id=pair.id,
-                distance_km=distance,
-                when=departure,
-            ).first()
-            if not existing:
-                new += 1
-                if travel_time and re.search('[0-9]', travel_time):
-                    travel_time = int(re.sub(r'[^0-9]', '', travel_time))
-                else:
-                    travel_time = None
-                sdr = StationDistanceReading(
-                    station_pair=pair,
-                    distance_km=distance,
-                    when=departure,
-                    travel_time_u=travel_time,
-                    token=token,
-                )
-                db.session.add(sdr)
+            if travel_time and re.search('[0-9]', str(travel_time)):
+                travel_time = int(re.sub(r'[^0-9]', '', str(travel_time)))
+            else:
+                travel_time = None
+            readings.append({
+                'station_pair_id': pair.id,
+                'distance_km': distance,
+                'when': departure,
+                'travel_time_u': travel_time,
+                'token_id': token.id,
+            })
         if first_price_ratio is not None:
             price_count += 1
             db.session.add(
@@ -107,25 +112,87 @@ def add_distance():
                     token=token,
                 )
             )
+
+    new_readings = filter_new_distance_readings(readings)
+    new = len(new_readings)
+    db.session.bulk_insert_mappings(StationDistanceReading, new_readings)
+    StationPairSummary.record(new_readings)
     db.session.commit()
     print('Recorded {} distance pairs ({} new, {} prices) for {} by {}'.format(count, new, price_count, payload['source'], token.character.name))
     return jsonify({'recorded': True, 'message': 'Recorded {} distance pairs, of which {} were new. +1 brownie point'.format(count, new)})
 
+def stored_readings_query(pair_ids, timestamps):
+    """
+    Pair ID, distance and time of the stored readings of `pair_ids` at any
+    of `timestamps`.
+    """
+    SDR = StationDistanceReading
+    return db.session.query(SDR.station_pair_id, SDR.distance_km, SDR.when) \
+        .filter(SDR.station_pair_id.in_(pair_ids), SDR.when.in_(timestamps))
+
+def pair_readings_query(pair_id, since=None):
+    """
+    Time (as POSIX timestamp) and distance of the readings of a pair since
+    `since` (a datetime, or `None` for all), ordered by time.
+    """
+    SDR = StationDistanceReading
+    query = db.session.query(extract('epoch', SDR.when), SDR.distance_km).filter(SDR.station_pair_id == pair_id)
+    if since is not None:
+        query = query.filter(SDR.when >= since)
+    return query.order_by(SDR.when)
+
+def filter_new_distance_readings(readings):
+    """
+    Returns those of `readings` (dicts with `station_pair_id`, `distance_km`
+    and `when`) that are neither stored yet nor duplicated within `readings`.
+    Existing readings are looked up with a single query for all pairs.
+    """
+    def key(r):
+        return (r['station_pair_id'], r['distance_km'], r['when'])
+
+    SDR = StationDistanceReading
+    timestamps = [r['when'] for r in readings if isinstance(r['when'], datetime)]
+    existing = set()
+    if timestamps:
+        query = stored_readings_query({r['station_pair_id'] for r in readings}, timestamps)
+        existing = {tuple(row) for row in query}
+    new = []
+    for r in readings:
+        if key(r) in existing:
+            continue
+        if not isinstance(r['when'], datetime):
+            # departure that is not in GCT format, leave parsing to the database
+            if SDR.query.filter_by(station_pair_id=r['station_pair_id'], distance_km=r['distance_km'], when=r['when']).first():
+                continue
+        existing.add(key(r))
+        new.append(r)
+    return new
+
 def get_station_pairs(system):
+    """
+    Returns the pairs of `system` that have readings, keyed by name, from
+    a single query over the pair summaries.
+    """
+    SP = StationPair
+    query = db.session.query(SP, StationPairSummary) \
+        .join(StationPairSummary, StationPairSummary.station_pair_id == SP.id) \
+        .filter(SP.system_id == system.id, StationPairSummary.reading_count > 0) \
+        .options(db.joinedload(SP.station_a), db.joinedload(SP.station_b))
     pairs = {}
-    for sp in StationPair.query.filter_by(system_id=system.id):
-        count = sp.readings_count
-        if count > 0:
-            pairs[str(sp)] = {
-                'id': sp.id,
-                'count': count,
-                'url': url_for('distance_pair', id=sp.id),
-                'has_fit': sp.has_full_fit,
-                'fit_period_u': sp.fit_period_u,
-                'fit_min_distance_km': sp.fit_min_distance_km,
-                'fit_max_distance_km': sp.fit_max_distance_km,
-                'fit_phase': sp.fit_phase,
-            }
+    for sp, summary in query:
+        pairs[str(sp)] = {
+            'id': sp.id,
+            'count': summary.reading_count,
+            'min_distance_km': summary.min_distance_km,
+            'max_distance_km': summary.max_distance_km,
+            'last_reading': summary.last_reading,
+            'url': url_for('distance_pair', id=sp.id),
+            'has_fit': sp.has_full_fit,
+            'fit_period_u': sp.fit_period_u,
+            'fit_min_distance_km': sp.fit_min_distance_km,
+            'fit_max_distance_km': sp.fit_max_distance_km,
+            'fit_phase': sp.fit_phase,
+        }
     return pairs
 
 @app.route('/distance')
@@ -135,30 +202,76 @@ def distance_overview():
     systems = System.query.order_by(System.rank, System.name).all()
     return render_template('distance_overview.html', systems=systems)
 
+# resolution of the distance chart: default and upper limit of the points
+chart_points = 2000
+max_chart_points = 20000
+
+def chart_readings(pair_id, since, points, count):
+    """
+    Returns arrays of POSIX timestamps and distances of the readings of a
+    pair since `since` (a datetime, or `None` for all), for plotting.
+
+    If there could be more than `points` readings (`count` is the total
+    count of the pair), the time range is split into `points / 2` equally
+    wide buckets, and only the readings with the minimal and maximal
+    distance in each bucket are returned, so that the chart keeps the
+    envelope of the oscillation at bounded size.
+    """
+    SDR = StationDistanceReading
+    epoch = extract('epoch', SDR.when)
+    condition = [SDR.station_pair_id == pair_id]
+    if since is not None:
+        condition.append(SDR.when >= since)
+
+    if count <= points:
+        rows = pair_readings_query(pair_id, since).all()
+        rows = np.array(rows, dtype=float).reshape(-1, 2)
+        return rows[:, 0], rows[:, 1]
+
+    start, end = db.session.query(func.min(epoch), func.max(epoch)).filter(*condition).one()
+    if start is None:
+        return np.array([]), np.array([])
+    width = max((float(end) - float(start)) / (points // 2), 1.0)
+    bucket = func.floor((epoch - float(start)) / width)
+    rows = db.session.query(
+        array_agg(aggregate_order_by(epoch, SDR.distance_km))[1],
+        func.min(SDR.distance_km),
+        array_agg(aggregate_order_by(epoch, SDR.distance_km.desc()))[1],
+        func.max(SDR.distance_km),
+    ).filter(*condition).group_by(bucket).order_by(bucket).all()
+    rows = np.array(rows, dtype=float).reshape(-1, 4)
+
+    # both extremes of each bucket, in the order they were recorded
+    when = rows[:, [0, 2]]
+    distance = rows[:, [1, 3]]
+    order = np.argsort(when, axis=1)
+    when = np.take_along_axis(when, order, axis=1).ravel()
+    distance = np.take_along_axis(distance, order, axis=1).ravel()
+    keep = np.ones(len(when), dtype=bool)
+    keep[1::2] = when[1::2] != when[0::2]
+    return when[keep], distance[keep]
+
 @app.route('/distance/pair/<id>')
 def distance_pair(id):
     id = int(id)
-    readings = []
-    sdr_m = StationDistanceReading
     pair = StationPair.query.filter_by(id=id).one()
+    summary = pair.summary
+    points = min(max(request.args.get('points', chart_points, type=int), 10), max_chart_points)
+
     limit_days = None
-    query = sdr_m.query.filter_by(station_pair_id=id)
+    since = None
     if pair.fit_period_u:
         limit_days = math.ceil(8 * math.ceil(pair.fit_period_u / 100e3 * 5) / 5)
+        if summary is not None and summary.last_reading is not None:
+            since = summary.last_reading - timedelta(days=limit_days)
 
-        latest = query.order_by(sdr_m.when.desc()).first()
-        if latest:
-            limit_qry = latest.when - timedelta(days=limit_days)
-            query = query.filter(sdr_m.when >= limit_qry)
-        
-    for r in query.order_by(sdr_m.when).all():
-        readings.append({'x': r.when.astimezone(pytz.UTC).strftime( "%Y-%m-%dT%H:%M:%SZ"), 'y': r.distance_km})
-
+    readings = []
     min_distance, max_distance = None, None
-    if r:
-        min_distance, max_distance = db.session.query(func.min(sdr_m.distance_km),
-                                                      func.max(sdr_m.distance_km)) \
-                                        .filter(sdr_m.station_pair_id == id).first()
+    if summary is not None:
+        min_distance, max_distance = summary.min_distance_km, summary.max_distance_km
+        when, distance = chart_readings(id, since, points, summary.reading_count)
+        timestamps = np.datetime_as_string((when * 1e6).astype('datetime64[us]'), unit='s')
+        readings = [{'x': x + 'Z', 'y': int(y)} for x, y in zip(timestamps, distance)]
 
     result = {
         'id': id,
@@ -172,7 +285,13 @@ def distance_pair(id):
         'has_prediction': pair.has_full_fit,
         'fit_period_u': pair.fit_period_u and gct_duration(int(pair.fit_period_u * 0.864)),
         'limit_days': limit_days,
+        'points': points,
+        'departures': None,
     }
+    if pair.has_full_fit:
+        start = now_u()
+        index = get_departure_index(pair.system_id, 3)
+        result['departures'] = index.departures(pair.station_a_id, pair.station_b_id, start, start + 3 * units_per_day)
     if request.content_type == 'application/json':
         return jsonify(result)
     result['readings'] = json.dumps(result['readings'])
@@ -182,18 +301,82 @@ def distance_pair(id):
 def distance_pair_csv(id):
     id = int(id)
     pair = StationPair.query.filter_by(id=id).one()
-    rows = ["Time/UTC,Time/GCT,Distance/km\n"]
-    for r in StationDistanceReading.query.filter_by(station_pair_id=id).order_by(StationDistanceReading.when).all():
-        when = r.when.astimezone(pytz.UTC)
-        rows.append('{},{},{}\n'.format(
-            when.strftime( "%Y-%m-%dT%H:%M:%SZ"),
-            as_gct(when),
-            r.distance_km,
-        ))
-    response = Response(''.join(rows), mimetype='text/csv')
+    query = pair_readings_query(id).yield_per(5000)
+
+    def generate():
+        yield "Time/UTC,Time/GCT,Distance/km\n"
+        rows = []
+        for row in query:
+            rows.append(row)
+            if len(rows) >= 5000:
+                yield distance_csv_lines(rows)
+                rows = []
+        if rows:
+            yield distance_csv_lines(rows)
+
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
     response.headers['Content-Disposition'] = 'attachment; filename=pair-{}.csv'.format(id)
     return response
 
+def distance_csv_lines(rows):
+    """
+    Formats (epoch seconds, distance) rows as CSV lines, converting all
+    timestamps at once.
+    """
+    rows = np.array(rows, dtype=float)
+    utc = np.datetime_as_string(np.round(rows[:, 0] * 1e6).astype('datetime64[us]'), unit='s')
+    gct = format_gct_units(gct_units_from_epoch(rows[:, 0]))
+    distance = rows[:, 1].astype(np.int64).astype(str)
+    lines = np.char.add(np.char.add(np.char.add(np.char.add(utc, 'Z,'), gct), ','), distance)
+    return '\n'.join(lines.tolist()) + '\n'
+
+@app.route('/distance/system/<system_id>.npz')
+def distance_system_npz(system_id):
+    """
+    All distance readings of a system as compressed NumPy arrays, for
+    offline analysis: `pair_id`, `gct_units` and `distance_km` with one
+    entry per reading, ordered by pair and time, and `pairs`,
+    `station_a` and `station_b` describing the pairs.
+    """
+    system = System.query.filter_by(id=int(system_id)).one()
+    SDR = StationDistanceReading
+    SP = StationPair
+    pairs = SP.query.filter_by(system_id=system.id) \
+        .options(db.joinedload(SP.station_a), db.joinedload(SP.station_b)).order_by(SP.id).all()
+    query = db.session.query(SDR.station_pair_id, extract('epoch', SDR.when), SDR.distance_km) \
+        .join(SP, SP.id == SDR.station_pair_id) \
+        .filter(SP.system_id == system.id) \
+        .order_by(SDR.station_pair_id, SDR.when)
+
+    # convert the rows in chunks, so that only one chunk of them exists as
+    # Python tuples at any time
+    pair_ids, units, distances = [], [], []
+    def convert(rows):
+        rows = np.array(rows, dtype=float).reshape(-1, 3)
+        pair_ids.append(rows[:, 0].astype(np.int32))
+        units.append(gct_units_from_epoch(rows[:, 1]).astype(np.int64))
+        distances.append(rows[:, 2].astype(np.int32))
+    rows = []
+    for row in query.yield_per(5000):
+        rows.append(row)
+        if len(rows) >= 5000:
+            convert(rows)
+            rows = []
+    convert(rows)
+
+    buf = BytesIO()
+    np.savez_compressed(buf,
+        pair_id=np.concatenate(pair_ids),
+        gct_units=np.concatenate(units),
+        distance_km=np.concatenate(distances),
+        pairs=np.array([p.id for p in pairs], dtype=np.int32),
+        station_a=np.array([p.station_a.name for p in pairs]),
+        station_b=np.array([p.station_b.name for p in pairs]),
+    )
+    response = Response(buf.getvalue(), mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = 'attachment; filename=system-{}.npz'.format(system.id)
+    return response
+
 
 @app.route('/distance/pair/<id>/prediction_png')
 def distance_pair_prediction_png(id):
@@ -204,120 +387,62 @@ def distance_pair_prediction_png(id):
     assert pair.fit_max_distance_km is not None, 'No max distance fit known'
     assert pair.fit_phase is not None, 'No phase fit known'
 
-    start = datetime.now(timezone.utc)
+    # the plot starts at the beginning of a 10 minute bucket, so that the
+    # same image can be served for all requests within that bucket
+    start = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    start -= timedelta(minutes=start.minute % 10)
     end  = start + timedelta(days=1)
     SDR = StationDistanceReading
-    readings = SDR.query.filter_by(station_pair_id=pair.id)\
-               .filter(SDR.when >=start, SDR.when < end).order_by(SDR.when)
-    x = []
-    y = []
-    for reading in readings:
-        x.append(float(as_gct(reading.when, format=False)))
-        y.append(float(reading.distance_km))
+    readings = db.session.query(extract('epoch', SDR.when), SDR.distance_km) \
+               .filter(SDR.station_pair_id == pair.id, SDR.when >=start, SDR.when < end).order_by(SDR.when)
+    readings = np.array(readings.all(), dtype=float).reshape(-1, 2)
+    x = gct_units_from_epoch(readings[:, 0])
+    y = readings[:, 1]
 
     xr = np.linspace(float(as_gct(start, format=False)), float(as_gct(end, format=False)), 1000)
 
-    maxs = pair.fit_max_distance_km ** 2
-    mins = pair.fit_min_distance_km ** 2
-
-    baseline =(maxs + mins) / 2
-    amplitude = (maxs - mins) / 2
-    yr = np.sqrt(baseline +  amplitude * np.cos(xr * (2 * np.pi / pair.fit_period_u) + pair.fit_phase))
-
-    plt.clf()
-    plt.cla()
-    plt.plot(xr, yr, 'b-', label='predicted values')
-
-    if len(x) > 2:
-        plt.plot(x, y, 'ro', label='Measurement')
-    # plt.gcf().set_size_inches(12, 9)
-    plt.title(str(pair))
-    plt.ylabel('Distance/km')
-    plt.xlabel('Time/u')
-    plt.legend()
-    plt.tight_layout()
-    img = BytesIO()
-    plt.savefig(img)
-    img.seek(0)
-    return send_file(img, mimetype='image/png')
-
-class StationPosition:
-    def __init__(self, station, time, phase):
-        self.station = station
-        self.time    = time
-        self.phase   = phase
-
-    @property
-    def x(self):
-        return self.station.fit_radius_km * math.cos(self.phase)
-
-    @property
-    def y(self):
-        return self.station.fit_radius_km * math.sin(self.phase)
-
-    def distance_to(self, other):
-        return np.sqrt( (other.y - self.y) ** 2 + (other.x - self.x) ** 2)
-
-def get_positions(system, time):
-    stations = Station.query.filter_by(system_id=system.id).order_by(Station.fit_radius_km.desc()).all()
-    base = stations.pop(0)
-
-    initial_phase = 0
-    if base.fit_period_u is not None:
-        arg = time / base.fit_period_u
-        arg - int(arg)
-        initial_phase = 2 * np.pi * arg
-
-    positions = [StationPosition(base, time, initial_phase)]
-    for station in stations:
-        pair = get_station_pair(station, base)
-        if pair.fit_period_u is None:
-            continue
-        arg = time / pair.fit_period_u
-        arg -= int(arg)
-        phase = pair.fit_phase + 2 * np.pi * arg
-        positions.append(StationPosition(station, time, phase + initial_phase))
-    return positions
+    yr = pair_distance(pair, xr)
+    key = ('prediction', pair.id, pair.fit_period_u, pair.fit_min_distance_km,
+           pair.fit_max_distance_km, pair.fit_phase, start, cache_key_part(readings))
+    return png_response(key, lambda: render_prediction(str(pair), xr, yr, x, y),
+                        last_modified=start)
+
+def current_plot_time():
+    """
+    Current time in GCT units, rounded down to 100 units, so that the system
+    plot URL (and image) is the same for all page views in that interval.
+    """
+    time = float(as_gct(datetime.now(timezone.utc), format=False))
+    return time - time % 100
 
 @app.route('/distance/system/<system_id>.png')
 def distance_system_png(system_id):
     system = System.query.filter_by(id=system_id).one()
     time = request.args.get('u')
     if time is None:
-        time = float(as_gct(datetime.now(timezone.utc), format=False))
+        time = current_plot_time()
     else:
-        time = float(time)
-
-    positions = get_positions(system, time)
-
-    x = [0] + [p.x for p in positions]
-    y = [0] + [p.y for p in positions]
-
-    size = positions[0].station.fit_radius_km * 1.1
-
-    plt.clf()
-    plt.cla()
-    fig, ax = plt.subplots()
-    plt.title('{} system'.format(system.name))
-    plt.xlabel('x / km')
-    plt.ylabel('y / km')
-    plt.ylim(-size, size)
-    plt.xlim(-size, size)
-    ax.scatter(x, y)
-    ax.annotate('Central body', (0.0, 0.0))
-    for p in positions:
-        ax.annotate(p.station.name, (p.x, p.y))
-    img = BytesIO()
-    plt.savefig(img)
-    img.seek(0)
-    return send_file(img, mimetype='image/png')
+        try:
+            time = parse_time_arg(time)
+        except ValueError as e:
+            return Response(str(e), status=400, mimetype='text/plain')
+
+    orbits = get_system_orbits(system.id)
+    x, y = orbits.positions(time)
+    size = orbits.size * 1.1 or 1.0
+    positions = [(name, round(float(px), 1), round(float(py), 1)) for name, px, py in zip(orbits.names, x, y)]
+    key = ('system', system.id, system.name, size, tuple(positions))
+    return png_response(key, lambda: render_system('{} system'.format(system.name), size, positions))
 
 @app.route('/distance/system/<system_id>')
 def distance_system(system_id):
     system = System.query.filter_by(id=system_id).one()
     dt = datetime.now(timezone.utc)
-    time = float(as_gct(dt, format=False))
-    
+    # the plot URL uses the rounded time, so that the image can be cached;
+    # the distance table is for the exact time shown on the page
+    time = current_plot_time()
+    orbits = get_system_orbits(system.id)
+
     return render_template('distance_system.html',
                            system=system,
                            system_name=system.name,
@@ -325,5 +450,166 @@ def distance_system(system_id):
                            station_pairs=get_station_pairs(system),
                            u=time,
                            gct=as_gct(dt),
-                           positions=get_positions(system, time),
+                           station_names=orbits.names,
+                           distances=orbits.distance_matrix(float(as_gct(dt, format=False))),
                            )
+
+## Distance predictions
+
+prediction_cache = TTLCache('prediction', ttl=300, maxsize=512)
+
+# limits for a single prediction request
+max_prediction_points = 10000
+max_system_prediction_points = 2000
+max_prediction_range_u = 10_000_000
+
+def parse_time_arg(value):
+    """
+    Parses a time given either in GCT units or as a GCT timestamp. Raises a
+    `ValueError` for anything else, including `nan` and `inf`.
+    """
+    try:
+        units = float(value)
+    except ValueError:
+        units = float(parse_gct_units([value.strip()])[0])
+    if not math.isfinite(units):
+        raise ValueError('Invalid time {!r}'.format(value))
+    return units
+
+def prediction_times(max_points):
+    """
+    Returns the times of a prediction request as a tuple, which doubles as
+    the cache key: either `u`, a comma separated list of times, or the range
+    from `from` (default: now, rounded down to 100 units) to `to` (default:
+    one day later) in steps of `step` (default: 100 units).
+
+    Raises a `ValueError` for invalid or too large requests.
+    """
+    if 'u' in request.args:
+        times = tuple(parse_time_arg(value) for value in request.args['u'].split(','))
+    else:
+        start = request.args.get('from')
+        start = current_plot_time() if start is None else parse_time_arg(start)
+        end = request.args.get('to')
+        end = start + 100_000 if end is None else parse_time_arg(end)
+        step = float(request.args.get('step', 100))
+        if not math.isfinite(step) or step <= 0 or end < start:
+            raise ValueError('Need to > from and a positive step')
+        if math.floor((end - start) / step) + 1 > max_points:
+            raise ValueError('Too many points, at most {} allowed'.format(max_points))
+        times = ('range', start, end, step)
+    if len(times) > max_points:
+        raise ValueError('Too many points, at most {} allowed'.format(max_points))
+    return times
+
+def prediction_time_array(times):
+    if times[0] == 'range':
+        _, start, end, step = times
+        return np.arange(start, end + step / 2, step)
+    return np.array(times)
+
+def cached_json_response(key, compute):
+    body = prediction_cache.get(key)
+    if body is None:
+        body = json.dumps(compute())
+        prediction_cache.set(key, body)
+    return Response(body, mimetype='application/json')
+
+@app.route('/v1/distance/prediction/pair/<pair_id>')
+def distance_prediction_pair(pair_id):
+    try:
+        times = prediction_times(max_prediction_points)
+        tolerance = float(request.args.get('tolerance', 0.1))
+        if not 0 < tolerance <= 1:
+            raise ValueError('tolerance must be between 0 and 1')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    pair = StationPair.query.filter_by(id=int(pair_id)).first()
+    if pair is None:
+        return jsonify({'message': 'Not found'}), 404
+    if not pair.has_full_fit:
+        return jsonify({'message': 'No fit known for this station pair'}), 409
+
+    def compute():
+        u = prediction_time_array(times)
+        result = {
+            'pair': {
+                'id': pair.id,
+                'station_a': pair.station_a.name,
+                'station_b': pair.station_b.name,
+                'period_u': pair.fit_period_u,
+                'min_distance_km': pair.fit_min_distance_km,
+                'max_distance_km': pair.fit_max_distance_km,
+                'phase': pair.fit_phase,
+            },
+            'u': u.tolist(),
+            'distance_km': pair_distance(pair, u).round(1).tolist(),
+            'minima': [],
+        }
+        if len(u) and u.max() - u.min() <= max_prediction_range_u:
+            minima, window_start, window_end = pair_minima(pair, u.min(), u.max(), tolerance)
+            result['minima'] = [
+                {
+                    'u': float(m),
+                    'gct': gct,
+                    'distance_km': pair.fit_min_distance_km,
+                    'window_from': float(w_start),
+                    'window_to': float(w_end),
+                }
+                for m, gct, w_start, w_end in zip(minima, format_gct_units(minima + 0.5), window_start, window_end)
+            ]
+        return result
+
+    # the fit is part of the key, so that a refit takes effect immediately
+    fit = (pair.fit_period_u, pair.fit_min_distance_km, pair.fit_max_distance_km, pair.fit_phase)
+    return cached_json_response(('pair', pair.id, fit, times, tolerance), compute)
+
+@app.route('/v1/distance/prediction/system/<system_id>')
+def distance_prediction_system(system_id):
+    try:
+        times = prediction_times(max_system_prediction_points)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    system = System.query.filter_by(id=int(system_id)).first()
+    if system is None:
+        return jsonify({'message': 'Not found'}), 404
+    orbits = get_system_orbits(system.id)
+
+    def compute():
+        u = prediction_time_array(times)
+        return {
+            'system': {'id': system.id, 'name': system.name},
+            'stations': [{'id': i, 'name': name} for i, name in zip(orbits.station_ids, orbits.names)],
+            'u': u.tolist(),
+            'distance_km': orbits.distance_matrix(u).round(1).tolist(),
+        }
+
+    # keyed on the orbital parameters, so that new fits take effect as soon
+    # as the orbit cache picks them up
+    fit = tuple(orbits.station_ids), cache_key_part(orbits.radius), cache_key_part(orbits.phase), \
+        cache_key_part(orbits.angular_velocity)
+    return cached_json_response(('system', system.id, fit, times), compute)
+
+@app.route('/v1/distance/best-departure/<system>/<source>/<destination>')
+def distance_best_departure(system, source, destination):
+    try:
+        days = float(request.args.get('days', 3))
+        assert 0 < days <= horizon_days, 'days must be between 0 and {}'.format(horizon_days)
+        source = get_station(system, source, create=False)
+        destination = get_station(system, destination, create=False)
+    except (AssertionError, ValueError) as e:
+        return jsonify({'message': str(e)})
+
+    start = now_u()
+    index = get_departure_index(source.system_id, days)
+    departures = index.departures(source.id, destination.id, start, start + days * units_per_day)
+    if departures is None:
+        return jsonify({'message': 'No fit known for this station pair'})
+    return jsonify({
+        'source': source.name,
+        'destination': destination.name,
+        'price_per_distance': index.price_per_distance(source.id, destination.id),
+        'departures': departures,
+    })
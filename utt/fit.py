@@ -0,0 +1,214 @@
+"""
+Fitting of station pair orbital parameters to the recorded distances.
+
+For two stations on circular orbits, the squared distance oscillates like
+
+    baseline + amplitude * cos(2π * u / period + phase)
+
+with u the time in GCT units. Fits are found by a Lomb-Scargle periodogram
+around an initial period estimate, refined by a least-squares curve fit.
+"""
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from astropy.timeseries import LombScargle
+from scipy.optimize import curve_fit
+from sqlalchemy import extract, func
+
+from utt.gct import gct_units_from_epoch
+from utt.model import db, StationPair, StationDistanceReading as SDR
+
+def squared_distance(x, period, amplitude, baseline, phase):
+    if amplitude > baseline:
+        return 1e20
+    return np.cos(np.array(x) * (2 * np.pi / period) + phase) * amplitude + baseline
+
+def readings_query(pair_ids=None):
+    """
+    Pair ID, time (as POSIX timestamp) and distance of the readings of all
+    station pairs (or just those in `pair_ids`), ordered by pair and time.
+    """
+    query = db.session.query(SDR.station_pair_id, extract('epoch', SDR.when), SDR.distance_km)
+    if pair_ids is not None:
+        query = query.filter(SDR.station_pair_id.in_(pair_ids))
+    return query.order_by(SDR.station_pair_id, SDR.when)
+
+def load_readings(pair_ids=None):
+    """
+    Loads the readings of all station pairs (or just those in `pair_ids`)
+    with a single query. Returns a dict mapping pair ID to a tuple of numpy
+    arrays (time in GCT units, squared distance in km²), ordered by time.
+    """
+    rows = np.array(readings_query(pair_ids).all(), dtype=float).reshape(-1, 3)
+
+    pair_column = rows[:, 0].astype(int)
+    units = gct_units_from_epoch(rows[:, 1])
+    squared = rows[:, 2] ** 2
+
+    ids, starts = np.unique(pair_column, return_index=True)
+    return {
+        int(pair_id): (x, y)
+        for pair_id, x, y in zip(ids, np.split(units, starts[1:]), np.split(squared, starts[1:]))
+    }
+
+def initial_parameters(pair, y):
+    """
+    Returns the starting point (period, amplitude, baseline, phase) for
+    fitting `pair`, with period `None` if there is no previous estimate.
+    """
+    min_y, max_y = np.min(y), np.max(y)
+    baseline = (min_y + max_y) / 2
+    amplitude = (max_y - min_y) / 2
+    if pair.fit_min_distance_km is not None and pair.fit_max_distance_km is not None:
+        baseline, amplitude = pair.baseline_amptlitude_pair
+    return pair.fit_period_u, amplitude, baseline, pair.fit_phase or 0.0
+
+def fit_pair(pair_id, x, y, initial, fudge_factor=2):
+    """
+    Fits the readings `x`, `y` of one pair, starting from `initial`
+    parameters; the periodogram searches periods within `fudge_factor`
+    of the initial period. Runs without database access, so that it can be
+    fanned out to worker processes.
+
+    Returns a dict with the fitted `period`, `min_distance`, `max_distance`
+    and `phase`, or `None` values plus a `message` if the fit did not
+    converge, and the time spent in `seconds`.
+    """
+    start = time.monotonic()
+    result = {
+        'pair_id': pair_id,
+        'count': len(x),
+        'converged': False,
+        'message': None,
+        'period': None,
+        'min_distance': None,
+        'max_distance': None,
+        'phase': None,
+    }
+    period, amplitude, baseline, phase = initial
+    try:
+        est_freq = 1 / period
+        freqs = np.linspace(est_freq / fudge_factor, est_freq * fudge_factor, 1600)
+        power = LombScargle(x, y).power(freqs)
+        period = 1 / freqs[np.argmax(power)]
+
+        initial = [period, amplitude, baseline, phase]
+        lower = [0.5 * period, 0.8 * amplitude, 0.5 * baseline, - 21 * np.pi]
+        upper = [2.0 * period, 10 * amplitude, 10 * baseline, 21 * np.pi]
+        fit_result, covariance = curve_fit(squared_distance, x, y, initial, bounds=[lower, upper])
+    except (RuntimeError, ValueError) as e:
+        result['message'] = str(e)
+    else:
+        period, amplitude, baseline, phase = fit_result
+        if amplitude > baseline:
+            result['message'] = 'Amplitude exceeds baseline'
+        else:
+            result.update(
+                converged=bool(np.all(np.isfinite(covariance))),
+                period=period,
+                min_distance=math.sqrt(baseline - amplitude),
+                max_distance=math.sqrt(baseline + amplitude),
+                phase=phase % (2 * np.pi),
+            )
+            if not result['converged']:
+                result['message'] = 'Covariance could not be estimated'
+    result['seconds'] = time.monotonic() - start
+    return result
+
+def fit_pairs(tasks, jobs=None):
+    """
+    Fits many pairs in a process pool. `tasks` is a list of argument
+    tuples for `fit_pair`; yields the results in the same order.
+    """
+    if not tasks:
+        return
+    if jobs == 1:
+        for task in tasks:
+            yield fit_pair(*task)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(fit_pair, *zip(*tasks))
+
+def is_small_difference(pair, result):
+    """
+    True if `result` converged and only differs from the stored fit of
+    `pair` by a small amount, so that it can be written without a human
+    looking at it.
+    """
+    def close(a, b):
+        return (a-b)/b <= 0.01
+
+    return pair.has_full_fit and result['converged'] and all((
+        close(result['period'], pair.fit_period_u),
+        close(pair.fit_min_distance_km, result['min_distance']),
+        close(pair.fit_max_distance_km, result['max_distance']),
+        close(pair.fit_phase, result['phase']),
+    ))
+
+def last_reading_ids(pair_ids=None):
+    """
+    Returns a dict mapping pair ID to the ID of its newest reading. Query it
+    before `load_readings`, so that readings arriving in between are newer
+    than the watermark and trigger a refit.
+    """
+    query = db.session.query(SDR.station_pair_id, func.max(SDR.id)).group_by(SDR.station_pair_id)
+    if pair_ids is not None:
+        query = query.filter(SDR.station_pair_id.in_(pair_ids))
+    return dict(query.all())
+
+def apply_fit(pair, result, last_reading_id):
+    """
+    Stores the fit `result` in `pair`, and advances its watermark to
+    `last_reading_id`, the newest reading the fit was based on.
+    """
+    pair.fit_period_u = result['period']
+    pair.fit_min_distance_km = result['min_distance']
+    pair.fit_max_distance_km = result['max_distance']
+    pair.fit_phase = result['phase']
+    pair.fit_last_reading_id = last_reading_id
+
+def pairs_with_new_readings():
+    """
+    Returns a list of (pair, newest reading ID) for all pairs with a full
+    fit that got readings since they were last fitted.
+    """
+    SP = StationPair
+    query = db.session.query(SP, func.max(SDR.id)) \
+        .join(SDR, SDR.station_pair_id == SP.id) \
+        .filter(SP.fit_period_u != None,
+                SP.fit_min_distance_km != None,
+                SP.fit_max_distance_km != None,
+                SP.fit_phase != None,
+                SDR.id > func.coalesce(SP.fit_last_reading_id, 0)) \
+        .group_by(SP.id) \
+        .options(db.joinedload(SP.station_a), db.joinedload(SP.station_b))
+    return query.all()
+
+def refit(jobs=None, write=True):
+    """
+    Refits the pairs that got new readings since their last fit, warm-started
+    from the stored parameters with a narrow periodogram window. Results are
+    written under the same small-difference policy as `autofit.py`; all
+    attempted pairs advance their watermark, so that they are only tried
+    again once more readings arrive.
+
+    Yields (pair, result, written) tuples.
+    """
+    pairs = {pair.id: (pair, last_reading_id) for pair, last_reading_id in pairs_with_new_readings()}
+    readings = load_readings(list(pairs))
+    tasks = []
+    for pair_id, (x, y) in readings.items():
+        pair, _ = pairs[pair_id]
+        baseline, amplitude = pair.baseline_amptlitude_pair
+        tasks.append((pair_id, x, y, (pair.fit_period_u, amplitude, baseline, pair.fit_phase), 1.1))
+
+    for result in fit_pairs(tasks, jobs):
+        pair, last_reading_id = pairs[result['pair_id']]
+        written = write and is_small_difference(pair, result)
+        if written:
+            apply_fit(pair, result, last_reading_id)
+        elif write:
+            pair.fit_last_reading_id = last_reading_id
+        yield pair, result, written
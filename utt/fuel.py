@@ -1,13 +1,12 @@
 from datetime import datetime, timedelta, timezone
 import json
-from io import BytesIO
 
-import matplotlib
-import matplotlib.pyplot as plt
-from flask import request, jsonify, Response, render_template, send_file
+from flask import request, jsonify, Response, render_template
 from sqlalchemy import func
 
 from .app import app
+from utt.cache import TTLCache
+from utt.plot import png_response, render_fuel_min_max
 from utt.util import today_datetime, today
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -16,6 +15,7 @@ from utt.model import db, \
                       Token, \
                       FuelPriceEstimation, \
                       FuelPriceReading, \
+                      FuelPriceSummary, \
                       FuelPriceStatistics as FPS, \
                       Station, \
                       System, \
@@ -55,6 +55,9 @@ def fuel_add():
         when = now(),
     )
     db.session.add(reading)
+    db.session.flush()
+    FuelPriceSummary.record(reading)
+    db.session.commit()
 
     response = {
         'recorded': True,
@@ -63,12 +66,34 @@ def fuel_add():
     }
     print('Recorded fuel price {} for station {} by  {}, {}'.format(price_per_g, station.name, token.character.name, datetime.now()))
 
-    db.session.commit()
-
     return jsonify(response)
 
-def render_fuel_add_response(current_station, token):
-    start_dt = now()
+# Rows of the table shown after recording a fuel price, keyed on the day and
+# the data version, so every new reading or estimation (from any worker
+# process) leads to a reload. A reading that commits after one with a higher
+# ID doesn't change the version; it shows up once the entry expires.
+fuel_table_cache = TTLCache('fuel_table', ttl=30, maxsize=4)
+
+def fuel_data_version():
+    """
+    Highest fuel price reading and estimation IDs. Every new reading and
+    every new set of estimations changes it, no matter which worker process
+    recorded them, and both are cheap lookups on the primary keys.
+    """
+    return db.session.query(
+        db.session.query(func.max(FuelPriceReading.id)).as_scalar(),
+        db.session.query(func.max(FuelPriceEstimation.id)).as_scalar(),
+    ).one()
+
+def fuel_table_rows():
+    key = (today(), tuple(fuel_data_version()))
+    rows = fuel_table_cache.get(key)
+    if rows is None:
+        rows = load_fuel_table_rows()
+        fuel_table_cache.set(key, rows)
+    return rows
+
+def load_fuel_table_rows():
     reference_date = today_datetime()
     rows = []
 
@@ -77,24 +102,38 @@ def render_fuel_add_response(current_station, token):
     for stat in FPS.query.filter(FPS.last_reading >= reference_date).order_by(FPS.last_price, FPS.station_name):
         station_name = stat.station_short_name or stat.station_name
         seen.add(station_name)
-        diff = start_dt - stat.last_reading
         rows.append({
+            'station_id':   stat.station_id,
             'station_name': station_name,
-            'is_current':   stat.station_id == current_station.id,
             'price_per_g':  stat.last_price,
-            'age': gct_duration(start_dt - stat.last_reading),
+            'last_reading': stat.last_reading,
         })
     # add estimations
     estimations = [e for e in FuelPriceEstimation.all_today() if e.station.short not in seen]
     for e in estimations:
         rows.append({
+            'station_id': None,
             'station_name': e.station.short,
-            'is_current': False,
             'price_per_g': e.price_per_g,
-            'age': '(est.)',
+            'last_reading': None,
         })
     rows.sort(key=lambda e: e['price_per_g'])
-    
+    return rows
+
+def render_fuel_add_response(current_station, token):
+    start_dt = now()
+    rows = []
+    for row in fuel_table_rows():
+        if row['last_reading'] is None:
+            age = '(est.)'
+        else:
+            age = gct_duration(start_dt - row['last_reading'])
+        rows.append({
+            'station_name': row['station_name'],
+            'is_current': row['station_id'] is not None and row['station_id'] == current_station.id,
+            'price_per_g': row['price_per_g'],
+            'age': age,
+        })
     return str(render_template('fuel_short_table.html', rows=rows, token=token))
 
 @app.route('/fuel')
@@ -112,26 +151,12 @@ def fuel_min_max_png():
         y1.append(fps.min_price)
         y2.append(fps.max_price)
 
-    plt.clf()
-    plt.cla()
-    plt.title('Fuel price over station level')
-    if x:
-        plt.axes(xticks=list(range(1, x[-1], 2)))
-    plt.plot(x, y1, 'bo', label='Min')
-    plt.plot(x, y2, 'ro', label='Max')
-    plt.xlabel('Station level')
-    plt.ylabel('Fuel price in credits / g')
-    plt.legend()
-    plt.tight_layout()
-    
-    img = BytesIO()
-    plt.savefig(img)
-    img.seek(0)
-    return send_file(img, mimetype='image/png')
+    key = ('fuel_min_max', tuple(x), tuple(y1), tuple(y2))
+    return png_response(key, lambda: render_fuel_min_max(x, y1, y2))
 
 @app.route('/fuel/stats/<token>.json')
 def fuel_stats_json(token):
-    token = Token.query.filter_by(token=token).first()
+    token = Token.query.filter_by(token=token, revoked=False).first()
     assert token, 'Need valid token'
     n = now()
 
@@ -168,7 +193,7 @@ def fuel_stats_json(token):
 
 @app.route('/fuel/lowest/<token>')
 def fuel_lowest(token):
-    token = Token.query.filter_by(token=token).first()
+    token = Token.query.filter_by(token=token, revoked=False).first()
     assert token, 'Need valid token'
     compare = bool(request.args.get('cmp', False))
     n = now()
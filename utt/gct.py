@@ -1,5 +1,6 @@
 import re
 from datetime import datetime, timedelta
+import numpy as np
 import pytz
 
 catastrophe = datetime(1964, 1, 22, 0, 0, 27, 689615, pytz.UTC)
@@ -35,3 +36,69 @@ def gct_duration(delta):
         return 'D{:02d}/{}'.format(days, unit_str)
     else:
         return 'D/' + unit_str
+
+## Vectorized variants, for converting many timestamps at once
+
+_catastrophe_us = np.datetime64(catastrophe.replace(tzinfo=None), 'us')
+_catastrophe_epoch_us = int(round(catastrophe.timestamp() * 1e6))
+
+# positions of the digits and separators in 'ddd.dd/dd:ddd'
+_gct_width = 13
+_gct_digit_positions = [0, 1, 2, 4, 5, 7, 8, 10, 11, 12]
+_gct_separators = {3: '.', 6: '/', 9: ':'}
+_gct_weights = 10 ** np.arange(9, -1, -1, dtype=np.int64)
+
+def gct_units_from_epoch(seconds):
+    """
+    Converts an array of POSIX timestamps (seconds since 1970, UTC) into
+    GCT units, rounded like `as_gct(dt, format=False)`.
+    """
+    micros = np.round(np.asarray(seconds, dtype=np.float64) * 1e6) - _catastrophe_epoch_us
+    return np.floor(micros / 864000 + 0.5)
+
+def gct_units_from_datetime64(dts):
+    """
+    Converts an array of numpy datetime64 values (interpreted as UTC) into
+    GCT units, rounded like `as_gct(dt, format=False)`.
+    """
+    micros = (np.asarray(dts, dtype='datetime64[us]') - _catastrophe_us).astype(np.int64)
+    return np.floor(micros / 864000 + 0.5)
+
+def gct_units_from_datetimes(dts):
+    """
+    Converts a sequence of timezone-aware `datetime` objects into GCT units.
+    """
+    return gct_units_from_epoch([dt.timestamp() for dt in dts])
+
+def datetime64_from_gct_units(units):
+    """
+    Converts an array of GCT units into numpy datetime64 values in UTC.
+    """
+    micros = np.round(np.asarray(units, dtype=np.float64) * 864000).astype(np.int64)
+    return _catastrophe_us + micros.astype('timedelta64[us]')
+
+def format_gct_units(units):
+    """
+    Formats an array of GCT units like `as_gct`, returns an array of strings
+    such as '204.32/99:968'.
+    """
+    units = np.asarray(units, dtype=np.int64)
+    digits = (units[:, None] // _gct_weights) % 10
+    codes = np.zeros((len(units), _gct_width), dtype=np.uint32)
+    codes[:, _gct_digit_positions] = digits + ord('0')
+    for position, separator in _gct_separators.items():
+        codes[:, position] = ord(separator)
+    return codes.view('U{}'.format(_gct_width)).reshape(len(units))
+
+def parse_gct_units(strings):
+    """
+    Parses an array of GCT strings like `parse_gct`, and returns their GCT
+    units as floats, with NaN for strings that are not valid GCT.
+    """
+    strings = np.asarray(strings, dtype=str).astype('U{}'.format(_gct_width))
+    codes = strings.view(np.uint32).reshape(len(strings), _gct_width)
+    digits = codes[:, _gct_digit_positions].astype(np.int64) - ord('0')
+    valid = np.all((digits >= 0) & (digits <= 9), axis=1)
+    for position, separator in _gct_separators.items():
+        valid &= codes[:, position] == ord(separator)
+    return np.where(valid, digits @ _gct_weights, np.nan)
@@ -1,18 +1,90 @@
 from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func, case, literal, literal_column, or_, text
+from utt.cache import TTLCache
 from utt.util import today
 
 db = SQLAlchemy()
 
+# (system name, station name), lower-cased -> column values of system and station
+station_cache = TTLCache('station', ttl=600)
+# token string -> column values of character and token. Kept short, because
+# revoking a token from another process only takes effect once it expires here.
+token_cache = TTLCache('token', ttl=60)
+
 class InvalidTokenException(Exception):
     def __init__(_=None):
         super().__init__('You need a valid token')
 
 
+def column_values(obj):
+    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns}
+
+def attach_cached(model, values, **related):
+    """
+    Returns a persistent `model` instance in the current session, built from
+    cached column `values` of a row known to exist, without querying the
+    database. If the session already holds that row, its instance is
+    returned unchanged, since the cached values may be outdated. Keyword
+    arguments name many-to-one relationships that are set to already
+    attached objects; all others are loaded lazily.
+    """
+    existing = db.session.identity_map.get(identity_key(model, values['id']))
+    if existing is not None:
+        return existing
+    obj = model(**values)
+    make_transient_to_detached(obj)
+    db.session.add(obj)
+    for name, value in related.items():
+        set_committed_value(obj, name, value)
+    return obj
+
+def _get_cached_station(system_name, station_name):
+    cached = station_cache.get((system_name.lower(), station_name.lower()))
+    if cached is None:
+        return None
+    system_values, station_values = cached
+    system = attach_cached(System, system_values)
+    return attach_cached(Station, station_values, system=system)
+
+def _cache_station(system_name, station_name, station):
+    if station.id is None:
+        return
+    station_cache.set(
+        (system_name.lower(), station_name.lower()),
+        (column_values(station.system), column_values(station)),
+    )
+
+# Stations created in a session are cached once they are committed: their
+# IDs are only known after the flush, and they must not be cached if the
+# transaction is rolled back.
+@event.listens_for(db.session, 'after_flush')
+def _snapshot_new_stations(session, flush_context):
+    for key, station in session.info.pop('new_stations', []):
+        session.info.setdefault('new_station_values', {})[key] = \
+            (column_values(station.system), column_values(station))
+
+@event.listens_for(db.session, 'after_commit')
+def _cache_new_stations(session):
+    for key, values in session.info.pop('new_station_values', {}).items():
+        station_cache.set(key, values)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_new_stations(session, previous_transaction):
+    session.info.pop('new_stations', None)
+    session.info.pop('new_station_values', None)
+
 def get_station(system_name, station_name, create=True):
+    station = _get_cached_station(system_name, station_name)
+    if station is not None:
+        return station
     system = System.query.filter(func.lower(System.name)==system_name.lower()).first()
     if not system:
         assert create, 'No such system {}'.format(system_name)
@@ -29,8 +101,41 @@ def get_station(system_name, station_name, create=True):
             '{} does not look like a proper station name'.format(station_name)
         station = Station(system=system, name=station_name, name_lower=station_name.lower())
         db.session.add(station)
+        db.session.info.setdefault('new_stations', []).append(
+            ((system_name.lower(), station_name.lower()), station))
+        return station
+    _cache_station(system_name, station_name, station)
     return station
 
+def get_stations(system_name, station_names, create=True):
+    """
+    Bulk version of `get_station`: resolves all of `station_names` within one
+    system from the cache, or else with a single query, and returns a dict
+    mapping each name to its station. Unknown stations are created (or
+    rejected) just like `get_station` does.
+    """
+    by_name_lower = {}
+    for name in station_names:
+        station = _get_cached_station(system_name, name)
+        if station is not None:
+            by_name_lower[name.lower()] = station
+    uncached = sorted({name.lower() for name in station_names} - set(by_name_lower))
+    if uncached:
+        system = System.query.filter(func.lower(System.name)==system_name.lower()).first()
+        if system:
+            stations = Station.query.filter(Station.system_id == system.id, Station.name_lower.in_(uncached))
+            for station in stations:
+                by_name_lower[station.name_lower] = station
+                _cache_station(system_name, station.name, station)
+    result = {}
+    for name in station_names:
+        station = by_name_lower.get(name.lower())
+        if station is None:
+            station = get_station(system_name, name, create=create)
+            by_name_lower[name.lower()] = station
+        result[name] = station
+    return result
+
 ## General classes
 class System(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -57,12 +162,14 @@ class Station(db.Model):
     has_public_shuttles = db.Column(db.Boolean(), nullable=False, default=True)
     # fit_phase = db.Column(db.Float)
 
-    def _filter_model_by_station_and_today(self, model, station_id_column):
+    def readings_today(self, model, station_id_column):
         from .util import today_datetime
-        existing = model.query.filter(model.when > today_datetime())\
+        return model.query.filter(model.when > today_datetime())\
             .filter(station_id_column == self.id) \
-            .order_by(model.when.desc()).first()
-        return existing is None
+            .order_by(model.when.desc())
+
+    def _filter_model_by_station_and_today(self, model, station_id_column):
+        return self.readings_today(model, station_id_column).first() is None
 
     @property
     def needs_career_update(self):
@@ -88,19 +195,39 @@ class Token(db.Model):
     character_id = db.Column(db.ForeignKey('character.id'), nullable=False)
     character = db.relationship('Character', backref=db.backref('tokens', lazy=True))
     full_read_permission = db.Column(db.Boolean(), nullable=False, default=False)
+    revoked = db.Column(db.Boolean(), nullable=False, default=False)
 
     @classmethod
     def verify(cls, token):
+        cached = token_cache.get(token)
+        if cached is not None:
+            character_values, token_values = cached
+            character = attach_cached(Character, character_values)
+            return attach_cached(cls, token_values, character=character)
         try:
-            return cls.query.filter_by(token=token).one()
+            result = cls.query.filter_by(token=token, revoked=False).one()
         except NoResultFound:
             raise InvalidTokenException()
+        token_cache.set(token, (column_values(result.character), column_values(result)))
+        return result
 
+    @classmethod
+    def revoke(cls, token):
+        """
+        Marks `token` as revoked, and returns whether it exists. Other
+        processes honor this once their cached copy expired.
+        """
+        count = cls.query.filter_by(token=token).update({'revoked': True})
+        token_cache.invalidate(token)
+        return count > 0
 
     def record_script_version(self, version):
         if version is None:
             version = 'pre 1.7'
-        self.character.last_script_version = str(version);
+        version = str(version)
+        if self.character.last_script_version != version:
+            self.character.last_script_version = version
+            token_cache.invalidate(self.token)
 
 ## Career task bonus tracking
 class CareerBatchSubmission(db.Model):
@@ -116,12 +243,52 @@ class CareerBatchSubmission(db.Model):
     station = db.relationship('Station')
     factor = db.Column(db.Float())
 
+    __table_args__ = (
+        db.Index('ix_career_batch_submission_station_id_when', 'station_id', 'when'),
+    )
+
 class CareerTask(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), unique=True, nullable=False)
     career = db.Column(db.String(250))
+    # lowest bonus ever recorded for this task
     bonus_baseline = db.Column(db.Float())
 
+    def lower_baseline(self, baseline):
+        """
+        Sets a new, lower baseline, and updates the stored factors of all
+        readings of this task to it. The factors of existing batches stay
+        as they were recorded.
+        """
+        self.bonus_baseline = baseline
+        if self.id is not None:
+            CareerTaskReading.query.filter_by(career_task_id=self.id) \
+                .update({'factor': CareerTaskReading.bonus / baseline}, synchronize_session=False)
+
+    @classmethod
+    def rebuild_baselines(cls):
+        """
+        Sets the baseline of every task to the lowest recorded bonus (if
+        it isn't lower already), and recomputes all stored reading factors.
+        Batch factors are historical and left alone.
+        """
+        db.session.execute(text('''
+            UPDATE career_task
+               SET bonus_baseline = m.min_bonus
+              FROM (SELECT career_task_id, MIN(bonus) AS min_bonus
+                      FROM career_task_reading
+                     GROUP BY career_task_id) m
+             WHERE m.career_task_id = career_task.id
+               AND (career_task.bonus_baseline IS NULL OR career_task.bonus_baseline > m.min_bonus)
+        '''))
+        db.session.execute(text('''
+            UPDATE career_task_reading
+               SET factor = career_task_reading.bonus / career_task.bonus_baseline
+              FROM career_task
+             WHERE career_task.id = career_task_reading.career_task_id
+               AND career_task.bonus_baseline > 0
+        '''))
+
 class CareerTaskReading(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     batch_submission_id = db.Column(db.ForeignKey('career_batch_submission.id'), nullable=False)
@@ -129,19 +296,8 @@ class CareerTaskReading(db.Model):
     career_task_id = db.Column(db.ForeignKey('career_task.id'), nullable=False)
     career_task = db.relationship('CareerTask', backref='readings')
     bonus = db.Column(db.Float(), nullable=False)
-
-    @property
-    def factor(self):
-        baseline = self.career_task.bonus_baseline
-        if baseline is None:
-            baseline = db.session.query(func.min(CareerTaskReading.bonus)).filter_by(career_task_id=self.career_task_id).first()
-            if baseline is None:
-                return None
-            baseline = baseline[0]
-            self.career_task.bonus_baseline = baseline
-            db.session.add(self.career_task)
-
-        return self.bonus / baseline
+    # bonus relative to the task's baseline, updated when the baseline changes
+    factor = db.Column(db.Float())
 
 ## Station distances
 def get_station_pair(a, b):
@@ -156,6 +312,28 @@ def get_station_pair(a, b):
         db.session.add(pair)
     return pair
 
+def get_station_pairs_from(station, others):
+    """
+    Bulk version of `get_station_pair`: returns a dict mapping each station in
+    `others` to its pair with `station`, using a single query for the
+    existing pairs and creating the missing ones.
+    """
+    SP = StationPair
+    existing = {}
+    if station.id is not None:
+        for pair in SP.query.filter(or_(SP.station_a_id == station.id, SP.station_b_id == station.id)):
+            other_id = pair.station_b_id if pair.station_a_id == station.id else pair.station_a_id
+            existing[other_id] = pair
+    result = {}
+    for other in others:
+        pair = existing.get(other.id) if other.id is not None else None
+        if pair is None:
+            pair = get_station_pair(station, other)
+            if other.id is not None:
+                existing[other.id] = pair
+        result[other] = pair
+    return result
+
 
 class StationPair(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -174,6 +352,8 @@ class StationPair(db.Model):
     fit_min_distance_km = db.Column(db.Float)
     fit_max_distance_km = db.Column(db.Float)
     fit_phase = db.Column(db.Float)
+    # ID of the newest reading that was available when last fitted
+    fit_last_reading_id = db.Column(db.Integer)
 
     __table_args__ = (
         db.UniqueConstraint('station_a_id', 'station_b_id'),
@@ -216,6 +396,76 @@ class StationDistanceReading(db.Model):
     token_id = db.Column(db.ForeignKey('token.id'), nullable=False)
     token = db.relationship('Token')
 
+    __table_args__ = (
+        db.Index('ix_station_distance_reading_station_pair_id_when', 'station_pair_id', 'when'),
+    )
+
+class StationPairSummary(db.Model):
+    """
+    Per-pair aggregates of the distance readings, kept up to date by
+    `add_distance`, so that listing the pairs of a system doesn't need to
+    count all readings. Readings whose departure could not be parsed as GCT
+    are counted, but don't contribute to `first_reading` and `last_reading`.
+    """
+    station_pair_id = db.Column(db.ForeignKey('station_pair.id', ondelete='CASCADE'), primary_key=True)
+    station_pair = db.relationship('StationPair', backref=db.backref('summary', uselist=False))
+    reading_count = db.Column(db.Integer, nullable=False)
+    min_distance_km = db.Column(db.Integer, nullable=False)
+    max_distance_km = db.Column(db.Integer, nullable=False)
+    first_reading = db.Column(db.DateTime(timezone=True))
+    last_reading = db.Column(db.DateTime(timezone=True))
+
+    @classmethod
+    def record(cls, readings):
+        """
+        Adds `readings` (dicts with `station_pair_id`, `distance_km` and
+        `when`, as inserted by `add_distance`) to the summaries, with a
+        single statement for all pairs.
+        """
+        by_pair = {}
+        for r in readings:
+            summary = by_pair.setdefault(r['station_pair_id'], {
+                'station_pair_id': r['station_pair_id'],
+                'reading_count': 0,
+                'min_distance_km': r['distance_km'],
+                'max_distance_km': r['distance_km'],
+                'first_reading': None,
+                'last_reading': None,
+            })
+            summary['reading_count'] += 1
+            summary['min_distance_km'] = min(summary['min_distance_km'], r['distance_km'])
+            summary['max_distance_km'] = max(summary['max_distance_km'], r['distance_km'])
+            if isinstance(r['when'], datetime):
+                summary['first_reading'] = min(summary['first_reading'] or r['when'], r['when'])
+                summary['last_reading'] = max(summary['last_reading'] or r['when'], r['when'])
+        if not by_pair:
+            return
+
+        stmt = insert(cls.__table__).values(list(by_pair.values()))
+        current, new = cls.__table__.c, stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[current.station_pair_id],
+            set_={
+                'reading_count': current.reading_count + new.reading_count,
+                'min_distance_km': func.least(current.min_distance_km, new.min_distance_km),
+                'max_distance_km': func.greatest(current.max_distance_km, new.max_distance_km),
+                'first_reading': func.least(current.first_reading, new.first_reading),
+                'last_reading': func.greatest(current.last_reading, new.last_reading),
+            },
+        )
+        db.session.execute(stmt)
+
+    @classmethod
+    def rebuild(cls):
+        db.session.execute(text('DELETE FROM station_pair_summary'))
+        db.session.execute(text('''
+            INSERT INTO station_pair_summary (station_pair_id, reading_count, min_distance_km,
+                                              max_distance_km, first_reading, last_reading)
+            SELECT station_pair_id, COUNT(*), MIN(distance_km), MAX(distance_km), MIN("when"), MAX("when")
+              FROM station_distance_reading
+             GROUP BY station_pair_id
+        '''))
+
 class ShuttlePriceReading(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     source_station_id = db.Column(db.ForeignKey('station.id'), nullable=False)
@@ -228,6 +478,10 @@ class ShuttlePriceReading(db.Model):
     token_id = db.Column(db.ForeignKey('token.id'), nullable=False)
     token = db.relationship('Token')
 
+    __table_args__ = (
+        db.Index('ix_shuttle_price_reading_route_when', 'source_station_id', 'destination_station_id', 'when'),
+    )
+
 ## Fuel Price Tracking
 class FuelPriceReading(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -240,6 +494,10 @@ class FuelPriceReading(db.Model):
     price = db.Column(db.Float, nullable=False)
     price_per_g = db.Column(db.Float, nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_fuel_price_reading_station_id_when', 'station_id', 'when'),
+    )
+
 class FuelPriceEstimation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     station_id = db.Column(db.ForeignKey('station.id'), nullable=False)
@@ -249,12 +507,63 @@ class FuelPriceEstimation(db.Model):
 
     @classmethod
     def all_today(cls):
-        return cls.query.filter(cls.day == today()).order_by(cls.price_per_g.asc())
+        return cls.query.filter(cls.day == today()).options(db.joinedload(cls.station)) \
+            .order_by(cls.price_per_g.asc())
 
     @classmethod
     def today_as_dict(cls):
         return {e.station.short: e.price_per_g for e in cls.all_today()}
 
+class FuelPriceSummary(db.Model):
+    """
+    Per-station fuel price aggregates, kept up to date on each new reading,
+    so that pages don't need to aggregate all readings ever recorded.
+    The `fuel_price_statistics` view joins it with station and system.
+    """
+    station_id = db.Column(db.ForeignKey('station.id', ondelete='CASCADE'), primary_key=True)
+    last_reading = db.Column(db.DateTime(timezone=True), nullable=False)
+    min_price = db.Column(db.Float, nullable=False)
+    max_price = db.Column(db.Float, nullable=False)
+    last_price = db.Column(db.Float, nullable=False)
+
+    @classmethod
+    def record(cls, reading):
+        price = reading.price_per_g
+        stmt = insert(cls.__table__).values(
+            station_id=reading.station.id,
+            last_reading=reading.when,
+            min_price=price,
+            max_price=price,
+            last_price=price,
+        )
+        current, new = cls.__table__.c, stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[current.station_id],
+            set_={
+                'min_price': func.least(current.min_price, new.min_price),
+                'max_price': func.greatest(current.max_price, new.max_price),
+                'last_price': case([(new.last_reading >= current.last_reading, new.last_price)],
+                                   else_=current.last_price),
+                'last_reading': func.greatest(current.last_reading, new.last_reading),
+            },
+        )
+        db.session.execute(stmt)
+
+    @classmethod
+    def rebuild(cls):
+        db.session.execute(text('DELETE FROM fuel_price_summary'))
+        db.session.execute(text('''
+            INSERT INTO fuel_price_summary (station_id, last_reading, min_price, max_price, last_price)
+            SELECT DISTINCT ON (station_id)
+                   station_id,
+                   "when",
+                   MIN(price_per_g) OVER (PARTITION BY station_id),
+                   MAX(price_per_g) OVER (PARTITION BY station_id),
+                   price_per_g
+              FROM fuel_price_reading
+             ORDER BY station_id, "when" DESC
+        '''))
+
 class FuelPriceStatistics(db.Model):
     station_id = db.Column(db.ForeignKey('station.id'), primary_key=True, )
     station = db.relationship('Station')
@@ -275,6 +584,25 @@ class ShipClass(db.Model):
 
     key = 'name'
 
+    @classmethod
+    def resolve(cls, names):
+        """
+        Returns a dict from name to ID for all `names`, creating the missing
+        ship classes with a single upsert.
+        """
+        ids = {name: id for id, name in db.session.query(cls.id, cls.name).filter(cls.name.in_(names))}
+        missing = sorted(set(names) - set(ids))
+        if missing:
+            stmt = insert(cls.__table__).values([{'name': name} for name in missing])
+            # a no-op update, so that RETURNING also includes rows that
+            # another request created in the meantime
+            stmt = stmt.on_conflict_do_update(index_elements=[cls.__table__.c.name],
+                                              set_={'name': stmt.excluded.name})
+            stmt = stmt.returning(cls.__table__.c.id, cls.__table__.c.name)
+            ids.update({name: id for id, name in db.session.execute(stmt)})
+            print('Created ship classes {}'.format(', '.join(missing)))
+        return ids
+
 class Ship(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     registration = db.Column(db.String(), nullable=False, unique=True)
@@ -283,80 +611,212 @@ class Ship(db.Model):
     ship_class_id = db.Column(db.ForeignKey('ship_class.id'), nullable=False)
     ship_class = db.relationship('ShipClass')
     sightings = db.relationship('ShipSighting', order_by='asc(ShipSighting.when)', backref='ship')
+    sighting_streaks = db.relationship('ShipSightingStreak', order_by='asc(ShipSightingStreak.first_seen)',
+                                       backref='ship')
 
     key = 'registration'
 
-    @property
-    def last_sighting(self):
-        return ShipSighting.query.filter_by(ship_id=self.id).order_by(ShipSighting.when.desc()).first()
-
-    @property
-    def last_movement(self):
-        ls = self.last_sighting
-        if ls is None:
-            return None
-        previous = ShipSighting.query.filter_by(ship_id=self.id).filter(ShipSighting.station_id != ls.station_id) \
-            .order_by(ShipSighting.when.desc()).first()
-        if previous:
-            return previous.when
-
-    @property
-    def sighting_streaks(self):
-        cached = getattr(self, '_sighting_streaks', None)
-        if cached is not None:
-            return cached
-        streaks = []
-        current = []
-        for s in self.sightings:
-            if not current:
-                pass
-            elif current[-1].station_id != s.station_id:
-                streaks.append(ShipSightingStreak(current))
-                current = []
-            current.append(s)
-        if current:
-            streaks.append(ShipSightingStreak(current))
-        self._sighting_streaks = streaks
-        return streaks
+    @classmethod
+    def resolve(cls, ships):
+        """
+        Returns a dict from registration to ID for `ships` (dicts with
+        `registration`, `name`, `captain` and `ship_class_id`), with one
+        query for the known ships and one upsert for the new ones. Known
+        ships without a captain get the captain from `ships`.
+        """
+        by_registration = {ship['registration']: ship for ship in ships}
+        ids = {}
+        known = db.session.query(cls.id, cls.registration, cls.captain) \
+            .filter(cls.registration.in_(list(by_registration)))
+        for id, registration, captain in known:
+            ids[registration] = id
+            new_captain = by_registration[registration]['captain']
+            if not captain and new_captain:
+                cls.query.filter_by(id=id).update({'captain': new_captain}, synchronize_session=False)
+
+        missing = [ship for registration, ship in by_registration.items() if registration not in ids]
+        if missing:
+            stmt = insert(cls.__table__).values(missing)
+            current = cls.__table__.c
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[current.registration],
+                set_={'captain': case([(current.captain == '', stmt.excluded.captain)], else_=current.captain)},
+            )
+            stmt = stmt.returning(current.id, current.registration)
+            ids.update({registration: id for id, registration in db.session.execute(stmt)})
+        return ids
 
     @property
     def min_jumps(self):
-        ss = self.sighting_streaks
-        if not ss:
-            return 0
-        c = 0
-        previous_system_id = ss[0].station.system_id
-        for streak in ss[1:]:
-            if streak.station.system_id != previous_system_id:
-                c += 1
-                previous_system_id = streak.station.system_id
-        return c
+        return self.summary.jump_count if self.summary else 0
 
     @property
     def siblings(self):
         return Ship.query.filter(Ship.captain == self.captain, Ship.id != self.id)
 
 
-class ShipSightingStreak:
-    def __init__(self, sightings):
-        assert len(sightings) > 0, 'Empty streak makes no sense'
-        self.sightings = sightings
+class ShipSightingStreak(db.Model):
+    """
+    Consecutive sightings of a ship at the same station, compacted into one
+    row. Maintained on ingest by `record`; the raw sightings are kept in
+    `ShipSighting`.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    ship_id = db.Column(db.ForeignKey('ship.id'), nullable=False)
+    station_id = db.Column(db.ForeignKey('station.id'), nullable=False)
+    station = db.relationship('Station')
+    first_seen = db.Column(db.DateTime(timezone=True), nullable=False)
+    last_seen = db.Column(db.DateTime(timezone=True), nullable=False)
+    count = db.Column(db.Integer, nullable=False)
 
-    @property
-    def station(self):
-        return self.sightings[0].station
+    __table_args__ = (
+        db.Index('ix_ship_sighting_streak_ship_id_last_seen', 'ship_id', 'last_seen'),
+    )
 
-    @property
-    def ship(self):
-        return self.sightings[0].ship
+    @classmethod
+    def latest_query(cls, ship_ids):
+        """
+        Ship ID, ID and station ID of the latest streak of each of `ship_ids`.
+        """
+        return db.session.query(cls.ship_id, cls.id, cls.station_id) \
+            .filter(cls.ship_id.in_(ship_ids)) \
+            .distinct(cls.ship_id) \
+            .order_by(cls.ship_id, cls.last_seen.desc())
 
-    @property
-    def first(self):
-        return self.sightings[0]
+    @classmethod
+    def record(cls, ship_ids, station_id, when):
+        """
+        Records sightings of the ships with `ship_ids` (one entry per
+        sighting) at `station_id`: extends the latest streak of each ship
+        if it is at that station, and starts a new one otherwise.
+        """
+        counts = {}
+        for ship_id in ship_ids:
+            counts[ship_id] = counts.get(ship_id, 0) + 1
+        if not counts:
+            return
+        # Lock the ships (in a fixed order, against deadlocks) until the
+        # commit, so that concurrent submissions for the same ship can't
+        # both see no streak at this station and both start one.
+        db.session.query(Ship.id).filter(Ship.id.in_(list(counts))).order_by(Ship.id).with_for_update().all()
+        latest = cls.latest_query(list(counts))
+
+        extended = {}
+        for ship_id, streak_id, streak_station_id in latest:
+            if streak_station_id == station_id:
+                extended.setdefault(counts[ship_id], []).append(streak_id)
+                del counts[ship_id]
+        for count, streak_ids in extended.items():
+            cls.query.filter(cls.id.in_(streak_ids)).update(
+                {'count': cls.count + count, 'last_seen': func.greatest(cls.last_seen, when)},
+                synchronize_session=False,
+            )
+        if counts:
+            db.session.execute(cls.__table__.insert(), [
+                {'ship_id': ship_id, 'station_id': station_id, 'first_seen': when, 'last_seen': when,
+                 'count': count}
+                for ship_id, count in counts.items()
+            ])
 
-    @property
-    def last(self):
-        return self.sightings[-1]
+    @classmethod
+    def rebuild(cls):
+        """
+        Recomputes all streaks from the raw sightings.
+        """
+        db.session.execute(text('DELETE FROM ship_sighting_streak'))
+        db.session.execute(text('''
+            INSERT INTO ship_sighting_streak (ship_id, station_id, first_seen, last_seen, count)
+            SELECT ship_id, station_id, MIN("when"), MAX("when"), COUNT(*)
+              FROM (SELECT ship_id, station_id, "when",
+                           ROW_NUMBER() OVER (PARTITION BY ship_id ORDER BY "when")
+                         - ROW_NUMBER() OVER (PARTITION BY ship_id, station_id ORDER BY "when") AS streak
+                      FROM ship_sighting) s
+             GROUP BY ship_id, station_id, streak
+        '''))
+
+class ShipSummary(db.Model):
+    """
+    Per-ship aggregates of the sightings, kept up to date by `ship_add`, so
+    that the ship overview doesn't need to look at any sightings.
+    `last_movement` is the last time the ship was seen at its previous
+    station, `jump_count` the number of observed changes of the system.
+    """
+    ship_id = db.Column(db.ForeignKey('ship.id', ondelete='CASCADE'), primary_key=True)
+    ship = db.relationship('Ship', backref=db.backref('summary', uselist=False))
+    last_station_id = db.Column(db.ForeignKey('station.id'), nullable=False)
+    last_station = db.relationship('Station')
+    last_seen = db.Column(db.DateTime(timezone=True), nullable=False)
+    last_movement = db.Column(db.DateTime(timezone=True))
+    jump_count = db.Column(db.Integer, nullable=False)
+    sighting_count = db.Column(db.Integer, nullable=False)
+
+    @classmethod
+    def record(cls, ship_ids, station, when):
+        """
+        Adds sightings of the ships with `ship_ids` (one entry per
+        sighting) at `station` to the summaries, with a single statement.
+        """
+        counts = {}
+        for ship_id in ship_ids:
+            counts[ship_id] = counts.get(ship_id, 0) + 1
+        if not counts:
+            return
+
+        stmt = insert(cls.__table__).values([
+            {
+                'ship_id': ship_id,
+                'last_station_id': station.id,
+                'last_seen': when,
+                'last_movement': None,
+                'jump_count': 0,
+                'sighting_count': count,
+            }
+            for ship_id, count in counts.items()
+        ])
+        current, new = cls.__table__.c, stmt.excluded
+        moved = current.last_station_id != new.last_station_id
+        # spelled out, because SQLAlchemy doesn't correlate subqueries in ON CONFLICT clauses
+        previous_system_id = literal_column(
+            '(SELECT system_id FROM station WHERE station.id = ship_summary.last_station_id)')
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[current.ship_id],
+            set_={
+                'last_station_id': new.last_station_id,
+                'last_seen': func.greatest(current.last_seen, new.last_seen),
+                'last_movement': case([(moved, current.last_seen)], else_=current.last_movement),
+                'jump_count': current.jump_count
+                    + case([(previous_system_id != literal(station.system_id), 1)], else_=0),
+                'sighting_count': current.sighting_count + new.sighting_count,
+            },
+        )
+        db.session.execute(stmt)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recomputes all summaries from the sighting streaks.
+        """
+        db.session.execute(text('DELETE FROM ship_summary'))
+        db.session.execute(text('''
+            INSERT INTO ship_summary (ship_id, last_station_id, last_seen, last_movement,
+                                      jump_count, sighting_count)
+            SELECT ship_id,
+                   MAX(CASE WHEN recency = 1 THEN station_id END),
+                   MAX(last_seen),
+                   MAX(CASE WHEN recency = 1 THEN previous_last_seen END),
+                   COUNT(*) FILTER (WHERE system_id != previous_system_id),
+                   SUM(count)
+              FROM (SELECT streak.ship_id, streak.station_id, streak.last_seen, streak.count,
+                           station.system_id,
+                           LAG(station.system_id) OVER w AS previous_system_id,
+                           LAG(streak.last_seen) OVER w AS previous_last_seen,
+                           ROW_NUMBER() OVER (PARTITION BY streak.ship_id
+                                              ORDER BY streak.first_seen DESC) AS recency
+                      FROM ship_sighting_streak streak
+                      JOIN station ON station.id = streak.station_id
+                    WINDOW w AS (PARTITION BY streak.ship_id ORDER BY streak.first_seen)) s
+             GROUP BY ship_id
+        '''))
 
 class ShipSighting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -367,6 +827,10 @@ class ShipSighting(db.Model):
     token_id = db.Column(db.ForeignKey('token.id'), nullable=False)
     token = db.relationship('Token')
 
+    __table_args__ = (
+        db.Index('ix_ship_sighting_ship_id_when', 'ship_id', 'when'),
+    )
+
 def autovivify(model, attrs, update=False):
     """
     Tries to look up if an object matching the attributes in dict `attrs` exist.
@@ -698,6 +1162,7 @@ class VendorItemPriceReading(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('vendor_id', 'item_id', 'day'),
+        db.Index('ix_vendor_item_price_reading_inventory_item_day', 'vendor_inventory_id', 'item_id', 'day'),
     )
 
     @property
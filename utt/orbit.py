@@ -0,0 +1,144 @@
+"""
+Closed-form orbital model of the stations in a system.
+
+All stations are assumed to be on circular orbits around the central body.
+The station with the largest fitted radius is the base; the phase of every
+other station relative to the base comes from the fit of its pair with the
+base. Positions and distances are evaluated with NumPy for any number of
+times at once.
+"""
+import numpy as np
+from sqlalchemy import or_
+
+from utt.cache import TTLCache
+from utt.model import Station, StationPair
+
+orbit_cache = TTLCache('orbit', ttl=600)
+
+def pair_distance(pair, u):
+    """
+    Distance in km between the stations of `pair` at time(s) `u` (in GCT
+    units), directly from the pair's fit.
+    """
+    baseline, amplitude = pair.baseline_amptlitude_pair
+    u = np.asarray(u, dtype=float)
+    return np.sqrt(baseline + amplitude * np.cos(u * (2 * np.pi / pair.fit_period_u) + pair.fit_phase))
+
+def pair_minima(pair, start, end, tolerance=0.1):
+    """
+    Closed-form minima of the distance of `pair` between GCT units `start`
+    and `end`. Returns three arrays: the times of the minima, and the start
+    and end of the window around each minimum in which the squared distance
+    is within `tolerance` (as a fraction of the squared distance range) of
+    the minimum.
+    """
+    velocity = 2 * np.pi / pair.fit_period_u
+    # minimal distance where u * velocity + phase = pi + 2 pi k
+    first = np.ceil((start * velocity + pair.fit_phase - np.pi) / (2 * np.pi))
+    last = np.floor((end * velocity + pair.fit_phase - np.pi) / (2 * np.pi))
+    k = np.arange(first, last + 1)
+    minima = (np.pi * (2 * k + 1) - pair.fit_phase) / velocity
+    half_width = np.arccos(1 - 2 * tolerance) / velocity
+    return minima, minima - half_width, minima + half_width
+
+
+class SystemOrbits:
+    """
+    Orbital parameters of the stations of one system, as plain arrays, so
+    that instances can be cached and shared between requests.
+    """
+    def __init__(self, system_id, station_ids, names, radius, phase, angular_velocity):
+        self.system_id = system_id
+        self.station_ids = station_ids
+        self.names = names
+        self.radius = np.asarray(radius, dtype=float)
+        self.phase = np.asarray(phase, dtype=float)
+        self.angular_velocity = np.asarray(angular_velocity, dtype=float)
+        self.index = {station_id: i for i, station_id in enumerate(station_ids)}
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    @property
+    def size(self):
+        """Radius of the outermost orbit, in km."""
+        return float(self.radius[0]) if len(self) else 0.0
+
+    def angles(self, u):
+        """
+        Angles of all stations at time(s) `u`, with shape `u.shape + (n,)`.
+        """
+        u = np.asarray(u, dtype=float)
+        return self.phase + np.multiply.outer(u, self.angular_velocity)
+
+    def positions(self, u):
+        """
+        Returns arrays `x` and `y` (in km) of all stations at time(s) `u`,
+        each with shape `u.shape + (n,)`.
+        """
+        angles = self.angles(u)
+        return self.radius * np.cos(angles), self.radius * np.sin(angles)
+
+    def distance_matrix(self, u):
+        """
+        Distances between all stations at time(s) `u`, with shape
+        `u.shape + (n, n)`.
+        """
+        x, y = self.positions(u)
+        dx = x[..., :, np.newaxis] - x[..., np.newaxis, :]
+        dy = y[..., :, np.newaxis] - y[..., np.newaxis, :]
+        return np.hypot(dx, dy)
+
+    def distances(self, station_a_id, station_b_id, u):
+        """
+        Distance between two stations (by ID) at time(s) `u`.
+        """
+        a, b = self.index[station_a_id], self.index[station_b_id]
+        angles = self.angles(u)
+        return np.sqrt(self.radius[a] ** 2 + self.radius[b] ** 2
+                       - 2 * self.radius[a] * self.radius[b] * np.cos(angles[..., a] - angles[..., b]))
+
+
+def load_system_orbits(system_id):
+    """
+    Builds the orbital model of a system with two queries: one for the
+    stations, one for their pairs with the base station. Stations without a
+    fitted radius or without a period fit relative to the base are left out.
+    """
+    stations = Station.query.filter(Station.system_id == system_id, Station.fit_radius_km != None) \
+                            .order_by(Station.fit_radius_km.desc()).all()
+    if not stations:
+        return SystemOrbits(system_id, [], [], [], [], [])
+    base = stations[0]
+    base_velocity = 2 * np.pi / base.fit_period_u if base.fit_period_u else 0.0
+
+    SP = StationPair
+    relative = {}
+    query = SP.query.filter(or_(SP.station_a_id == base.id, SP.station_b_id == base.id),
+                            SP.fit_period_u != None, SP.fit_phase != None)
+    for pair in query:
+        other_id = pair.station_b_id if pair.station_a_id == base.id else pair.station_a_id
+        relative[other_id] = (pair.fit_phase, 2 * np.pi / pair.fit_period_u)
+
+    station_ids = [base.id]
+    names = [base.name]
+    radius = [base.fit_radius_km]
+    phase = [0.0]
+    velocity = [base_velocity]
+    for station in stations[1:]:
+        if station.id not in relative:
+            continue
+        station_phase, station_velocity = relative[station.id]
+        station_ids.append(station.id)
+        names.append(station.name)
+        radius.append(station.fit_radius_km)
+        phase.append(station_phase)
+        velocity.append(base_velocity + station_velocity)
+    return SystemOrbits(system_id, station_ids, names, radius, phase, velocity)
+
+def get_system_orbits(system_id):
+    orbits = orbit_cache.get(system_id)
+    if orbits is None:
+        orbits = load_system_orbits(system_id)
+        orbit_cache.set(system_id, orbits)
+    return orbits
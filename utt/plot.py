@@ -0,0 +1,104 @@
+"""
+PNG rendering of plots.
+
+Uses matplotlib's object oriented API instead of the global pyplot state,
+so that concurrent requests in threaded workers don't draw into each
+other's figures. Rendered images are cached by a key that determines their
+content, and served with ETag, Last-Modified and Cache-Control headers so
+that browsers and proxies can reuse them.
+"""
+import hashlib
+from io import BytesIO
+
+import numpy as np
+from flask import request, Response
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from utt.cache import TTLCache
+
+png_cache = TTLCache('png', ttl=3600, maxsize=256)
+
+def new_figure():
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig, fig.subplots()
+
+def figure_png(fig):
+    img = BytesIO()
+    fig.savefig(img, format='png')
+    return img.getvalue()
+
+def cache_key_part(array):
+    """
+    Condenses a (possibly large) numpy array into a short cache key component.
+    """
+    return hashlib.sha1(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+def png_response(key, render, last_modified=None, max_age=600):
+    """
+    Returns a response with the PNG image that `render()` produces.
+
+    `key` is a hashable tuple that determines the image content completely
+    (plot parameters, data, time bucket). It is used both to look up the
+    cached image and to derive the ETag, so that requests from clients that
+    already have the image get a 304 without rendering anything.
+    """
+    etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    response = Response(mimetype='image/png')
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+
+    png = png_cache.get(key)
+    if png is None:
+        png = render()
+        png_cache.set(key, png)
+    response.set_data(png)
+    return response.make_conditional(request)
+
+def render_prediction(title, xr, yr, x, y):
+    fig, ax = new_figure()
+    ax.plot(xr, yr, 'b-', label='predicted values')
+    if len(x) > 2:
+        ax.plot(x, y, 'ro', label='Measurement')
+    ax.set_title(title)
+    ax.set_ylabel('Distance/km')
+    ax.set_xlabel('Time/u')
+    ax.legend()
+    fig.tight_layout()
+    return figure_png(fig)
+
+def render_system(title, size, positions):
+    """
+    `positions` is a list of (station name, x, y) tuples.
+    """
+    fig, ax = new_figure()
+    ax.set_title(title)
+    ax.set_xlabel('x / km')
+    ax.set_ylabel('y / km')
+    ax.set_ylim(-size, size)
+    ax.set_xlim(-size, size)
+    ax.scatter([0] + [p[1] for p in positions], [0] + [p[2] for p in positions])
+    ax.annotate('Central body', (0.0, 0.0))
+    for name, x, y in positions:
+        ax.annotate(name, (x, y))
+    return figure_png(fig)
+
+def render_fuel_min_max(x, y1, y2):
+    fig, ax = new_figure()
+    ax.set_title('Fuel price over station level')
+    if x:
+        ax.set_xticks(list(range(1, x[-1], 2)))
+    ax.plot(x, y1, 'bo', label='Min')
+    ax.plot(x, y2, 'ro', label='Max')
+    ax.set_xlabel('Station level')
+    ax.set_ylabel('Fuel price in credits / g')
+    ax.legend()
+    fig.tight_layout()
+    return figure_png(fig)
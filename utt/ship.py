@@ -2,18 +2,21 @@ import json
 from datetime import datetime, timezone, timedelta
 
 from sqlalchemy.orm.exc import NoResultFound
-from flask import request, jsonify, render_template
+from flask import request, jsonify, render_template, abort
+from flask_sqlalchemy import Pagination
+from sqlalchemy import func
 
 from utt.app import app
 from utt.gct import as_gct
 from utt.model import (
     db,
-    autovivify,
     get_station,
     Token,
     Ship,
     ShipClass,
-    ShipSighting ,
+    ShipSighting,
+    ShipSightingStreak,
+    ShipSummary,
     Station,
     System,
 )
@@ -27,60 +30,97 @@ def ship_add():
     token = Token.verify(payload['token'])
     token.record_script_version(payload.get('script_version'))
     station = get_station(payload['system'], payload['station'])
-    count = 0
-    for ship_sighting in payload['ships']:
-        ship_class = autovivify(ShipClass, {'name': ship_sighting['class']})
-        ship = autovivify(Ship, {
-            'registration': ship_sighting['registration'],
-            'ship_class': ship_class,
-            'name': ship_sighting['name'],
-            'captain': ship_sighting['captain'],
-        })
-        if not ship.captain and ship_sighting['captain']:
-            ship.captain = ship_sighting['captain']
-            db.session.add(ship)
-        db.session.add(ShipSighting(
-            ship=ship,
-            station=station,
-            token=token,
-        ))
-        count += 1
+    ship_sightings = payload['ships']
+    class_ids = ShipClass.resolve({s['class'] for s in ship_sightings})
+    ship_ids = Ship.resolve([
+        {
+            'registration': s['registration'],
+            'name': s['name'],
+            'captain': s['captain'],
+            'ship_class_id': class_ids[s['class']],
+        }
+        for s in ship_sightings
+    ])
+    when = now()
+    if ship_sightings:
+        db.session.execute(ShipSighting.__table__.insert(), [
+            {
+                'ship_id': ship_ids[s['registration']],
+                'station_id': station.id,
+                'when': when,
+                'token_id': token.id,
+            }
+            for s in ship_sightings
+        ])
+        sighted_ids = [ship_ids[s['registration']] for s in ship_sightings]
+        ShipSightingStreak.record(sighted_ids, station.id, when)
+        ShipSummary.record(sighted_ids, station, when)
+    count = len(ship_sightings)
     db.session.commit()
     print('Recorded {} ship positions on {} by {}'.format(count, station.name, token.character.name))
     return jsonify({'success': True, 'num_recorded': count})
 
+ships_per_page = 100
+
+# columns the ship overview can be sorted by, as `order_by=<key>` or
+# `order_by=-<key>` for descending order
+ship_sort_columns = {
+    'name': Ship.name,
+    'captain': Ship.captain,
+    'registration': Ship.registration,
+    'class': ShipClass.name,
+    'last_seen': ShipSummary.last_seen,
+    'last_movement': ShipSummary.last_movement,
+    'jumps': ShipSummary.jump_count,
+    'sightings': ShipSummary.sighting_count,
+}
+
 @app.route('/ship/')
 def ship_overview():
-    ships = Ship.query.order_by(Ship.captain.asc(), Ship.name.asc())
+    page = max(request.args.get('page', 1, type=int), 1)
+    order_by = request.args.get('order_by', 'captain')
+    key = order_by.lstrip('-')
+    if key not in ship_sort_columns:
+        abort(400, 'Invalid order_by {!r}, expected one of {}'.format(order_by, ', '.join(ship_sort_columns)))
+    column = ship_sort_columns[key]
+    direction = column.desc() if order_by.startswith('-') else column.asc()
+
+    query = db.session.query(Ship, ShipClass, ShipSummary, Station) \
+        .join(ShipClass, Ship.ship_class_id == ShipClass.id) \
+        .outerjoin(ShipSummary, ShipSummary.ship_id == Ship.id) \
+        .outerjoin(Station, ShipSummary.last_station_id == Station.id) \
+        .order_by(direction.nullslast(), Ship.captain.asc(), Ship.name.asc(), Ship.id.asc())
+    items = query.limit(ships_per_page).offset((page - 1) * ships_per_page).all()
+    # every ship has exactly one row, so counting the ship table is enough
+    total = db.session.query(func.count(Ship.id)).scalar()
+    ships = Pagination(query, page, ships_per_page, total, items)
 
-    return render_template('ship/overview.html', ships=ships)
+    return render_template('ship/overview.html', ships=ships, order_by=order_by)
 
 def ship_timeline(ship):
-    stations = Station.query.join(System).filter(Station.id.in_(
-        db.session.query(ShipSighting.station_id).filter(ShipSighting.ship_id == ship.id)
-    )).order_by(System.rank.asc(), Station.name.asc()).all()
+    streaks = ship.sighting_streaks
+    stations = Station.query.join(System).filter(Station.id.in_({s.station_id for s in streaks})) \
+        .order_by(System.rank.asc(), Station.name.asc()).all()
     layers = {station.id: layer for layer, station in enumerate(stations)}
 
-    sightings = ship.sightings
-    timeline_start = sightings[0].when.date()
-    timeline_end = sightings[-1].when.date() + timedelta(days=1)
     data = []
-    for s in ship.sighting_streaks:
+    for s in streaks:
         data.append({
             'title': s.station.short or s.station.name,
-            'start': s.first.when.isoformat(),
-            'end':   s.last.when.isoformat(),
-            'layer': layers[s.station.id],
+            'start': s.first_seen.isoformat(),
+            'end':   s.last_seen.isoformat(),
+            'layer': layers[s.station_id],
         })
-    layers_seen = {d['layer'] for d in data}
     return {
-        'start': timeline_start,
-        'end': timeline_end,
+        'start': streaks[0].first_seen.date() if streaks else now().date(),
+        'end': max(s.last_seen for s in streaks).date() + timedelta(days=1) if streaks else now().date(),
         'data': json.dumps(data),
     }
 
 @app.route('/ship/<registration>')
 def ship_detail(registration):
-    ship = Ship.query.filter_by(registration=registration).one()
+    ship = Ship.query.filter_by(registration=registration) \
+        .options(db.joinedload(Ship.sighting_streaks).joinedload(ShipSightingStreak.station),
+                 db.joinedload(Ship.summary)).one()
 
     return render_template('ship/detail.html', ship=ship, timeline=ship_timeline(ship))